@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the slow parts of kanimaji, run them with eg.
+
+    ./benchmark.py rasterizers [KANJIVG_SVG_FILE...]
+    ./benchmark.py timing
+    ./benchmark.py stages [--gif] [--baseline FILE] [KANJIVG_SVG_FILE...]
+    ./benchmark.py startup [--repeat N]
+"""
+
+import argparse
+import glob
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+from io import BytesIO
+
+from lxml import etree
+
+import kanimaji
+from settings import *
+import timing
+
+# NumPy and the rasterizers are imported by the benchmarks needing them, so
+# that the startup one runs without them
+
+# checked in, from 1 to 30 strokes, so that timings can be compared over
+# time and offline
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'bench', 'kanji')
+BASELINE_FILE = os.path.join(os.path.dirname(CORPUS_DIR), 'baseline.json')
+
+STAGES = ['parse', 'geometry', 'css', 'serialize', 'rasterize', 'encode']
+
+
+def gif_frame_documents(filename):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    doc = etree.parse(filename, kanimaji.parser)
+    documents, delays = kanimaji.build_animations(
+        doc, name, kanimaji.default_settings(), ['gif'])['gif']
+    return documents
+
+
+def bench_rasterizers(filenames):
+    """Per kanji wall time of the rasterization of all the GIF frames."""
+    from rasterize import RASTERIZERS, get_rasterizer
+    backends = []
+    for name in sorted(RASTERIZERS):
+        try:
+            backends.append((name, get_rasterizer(name)))
+        except ImportError as e:
+            print '%s: not available (%s)' % (name, e)
+
+    print '%-12s %7s' % ('file', 'frames') + ''.join(
+        ' %12s' % name for name, backend in backends)
+    totals = dict((name, 0.0) for name, backend in backends)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for filename in filenames:
+            documents = gif_frame_documents(filename)
+            prefix = os.path.join(tmpdir, 'frame')
+            line = '%-12s %7d' % (os.path.basename(filename), len(documents))
+            for name, backend in backends:
+                start = timeit.default_timer()
+                try:
+                    list(backend.render(documents, GIF_SIZE, prefix))
+                except (OSError, RuntimeError):
+                    line += ' %12s' % 'failed'
+                    totals[name] = float('nan')
+                    continue
+                elapsed = timeit.default_timer() - start
+                totals[name] += elapsed
+                line += ' %11.3fs' % elapsed
+            print line
+    finally:
+        shutil.rmtree(tmpdir)
+    print '%-20s' % 'mean per kanji' + ''.join(
+        ' %11.3fs' % (totals[name] / len(filenames))
+        for name, backend in backends)
+
+
+def bench_timing(n=100000):
+    """
+    Evaluation of each timing function at n points, one at a time, over an
+    array at once, and interpolated from a table (including building it).
+    """
+    import numpy
+    x = numpy.random.RandomState(0).rand(n)
+    xs = x.tolist()
+    print '%-32s %10s %10s %10s %12s' % ('function', 'scalar', 'array',
+                                         'table', 'table error')
+    for name in sorted(['linear', 'ease', 'ease-in', 'ease-in-out',
+                        'ease-out', 'cubic-bezier(0.1, 0.7, 1, 0.1)',
+                        'steps(4, jump-both)']):
+        function = timing.parse(name)
+        start = timeit.default_timer()
+        exact = [function(v) for v in xs]
+        t_scalar = timeit.default_timer() - start
+
+        start = timeit.default_timer()
+        function.array(x)
+        t_array = timeit.default_timer() - start
+
+        # a new one, to include the sampling of its table
+        function = timing._parse(name)
+        start = timeit.default_timer()
+        approx = function.array(x, 1024)
+        t_table = timeit.default_timer() - start
+
+        print '%-32s %9.4fs %9.4fs %9.4fs %12.2g' % (
+            name, t_scalar, t_array, t_table,
+            numpy.abs(approx - exact).max())
+
+
+def _stage_times(filename, s, rasterizer, prefix):
+    """Seconds spent in each stage of animating filename."""
+    times = {}
+    name = os.path.splitext(os.path.basename(filename))[0]
+    with kanimaji.timed(times, 'parse'):
+        doc = etree.parse(filename, kanimaji.parser)
+    outputs = ['svg', 'js_svg'] + (['gif'] if rasterizer else [])
+    # no length cache, lengths are measured every time
+    results = kanimaji.build_animations(doc, name, s, outputs, times=times)
+    if rasterizer:
+        documents, delays = results['gif']
+        with kanimaji.timed(times, 'rasterize'):
+            # rendered here rather than while encoding
+            frames = list(rasterizer.render(documents, s.GIF_SIZE, prefix))
+        from rasterize import frame_images
+        gif_encoder = kanimaji.optional_module('gif_encoder')
+        if gif_encoder is not None:
+            with kanimaji.timed(times, 'encode'):
+                gif_encoder.write_gif(
+                    BytesIO(), frame_images(frames), delays,
+                    s.GIF_BACKGROUND_COLOR)
+    return times
+
+
+def _stroke_count(filename):
+    return len(etree.parse(filename).xpath(
+        "//n:g[starts-with(@id, 'kvg:StrokePaths_')]//n:path",
+        namespaces=kanimaji.namespaces))
+
+
+def bench_stages(filenames, repeat=10, gif=False, baseline=None,
+                 save_baseline=None, tolerance=0.1):
+    """
+    Time spent in each stage of create_animation per file, the best of
+    repeat runs, compared to the totals of the baseline file if any.
+    Returns whether no stage regressed by more than tolerance.
+    """
+    s = kanimaji.default_settings()
+    rasterizer = None
+    if gif:
+        from rasterize import get_rasterizer
+        rasterizer = get_rasterizer(s.GIF_RASTERIZER)
+    stages = [stage for stage in STAGES
+              if gif or stage not in ('rasterize', 'encode')]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print '%-18s %7s' % ('file', 'strokes') + ''.join(
+            ' %9s' % stage for stage in stages) + ' %9s' % 'total'
+        totals = dict((stage, 0.0) for stage in stages)
+        strokes = 0
+        for filename in filenames:
+            best = {}
+            for i in range(repeat):
+                times = _stage_times(filename, s, rasterizer,
+                                     os.path.join(tmpdir, 'frame'))
+                for stage, seconds in times.items():
+                    best[stage] = min(best.get(stage, seconds), seconds)
+            count = _stroke_count(filename)
+            strokes += count
+            for stage in stages:
+                totals[stage] += best.get(stage, 0)
+            print '%-18s %7d' % (os.path.basename(filename), count) + ''.join(
+                ' %7.2fms' % (1000 * best.get(stage, 0))
+                for stage in stages) + ' %7.2fms' % (
+                1000 * sum(best.get(stage, 0) for stage in stages))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    total = sum(totals.values())
+    print '%-26s' % 'total' + ''.join(
+        ' %7.2fms' % (1000 * totals[stage]) for stage in stages) + (
+        ' %7.2fms' % (1000 * total))
+    print '%.1f files/s, %.1f strokes/s, %.2fms per stroke' % (
+        len(filenames) / total, strokes / total, 1000 * total / strokes)
+    # kilobytes on Linux
+    print 'peak memory: %.1f MB' % (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+
+    results = {'files': len(filenames), 'strokes': strokes, 'gif': gif,
+               'stages': totals}
+    if save_baseline:
+        with open(save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+            f.write('\n')
+        print 'saved baseline %s' % save_baseline
+
+    ok = True
+    if baseline:
+        with open(baseline) as f:
+            previous = json.load(f)
+        if (previous['files'], previous['strokes'], previous['gif']) != (
+                len(filenames), strokes, gif):
+            print 'baseline %s is of another run, not comparing' % baseline
+            return ok
+        print 'compared to baseline %s:' % baseline
+        for stage in stages:
+            if stage not in previous['stages']:
+                continue
+            before, after = previous['stages'][stage], totals[stage]
+            # below a few tenths of a millisecond, it is noise
+            regressed = (after > before * (1 + tolerance) and
+                         after - before > 0.0002)
+            ok = ok and not regressed
+            print '  %-10s %8.2fms -> %8.2fms %+6.1f%%%s' % (
+                stage, 1000 * before, 1000 * after,
+                100 * (after - before) / (before or 1),
+                '  REGRESSION' if regressed else '')
+    return ok
+
+
+# run in a new interpreter: imports module, timing the first import of
+# every module it loads, without those it imports itself (as python 3's
+# -X importtime does), and prints them as JSON
+_IMPORT_TIMES = '''
+import __builtin__, json, sys, timeit
+real_import = __builtin__.__import__
+times = {}
+children = [0.0]
+def timed_import(name, *args, **kwargs):
+    new = name not in sys.modules
+    children.append(0.0)
+    start = timeit.default_timer()
+    try:
+        return real_import(name, *args, **kwargs)
+    finally:
+        elapsed = timeit.default_timer() - start
+        inner = children.pop()
+        children[-1] += elapsed
+        if new and name in sys.modules:
+            times[name] = times.get(name, 0) + elapsed - inner
+__builtin__.__import__ = timed_import
+start = timeit.default_timer()
+import %s
+total = timeit.default_timer() - start
+__builtin__.__import__ = real_import
+print json.dumps({'total': total, 'modules': times})
+'''
+
+
+def _run_seconds(args):
+    start = timeit.default_timer()
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(args, stdout=devnull, stderr=devnull)
+    return timeit.default_timer() - start
+
+
+def bench_startup(repeat=10, modules=('kanimaji', 'server'), slowest=10):
+    """
+    Time to import each of the modules in a new interpreter, and the
+    modules taking the most of it, then time to start the command line (as
+    --help) and the interpreter alone. The best of repeat runs is kept.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in modules:
+        totals = []
+        times = {}
+        for i in range(repeat):
+            result = json.loads(subprocess.check_output(
+                [sys.executable, '-c', _IMPORT_TIMES % module], cwd=here))
+            totals.append(result['total'])
+            for name, seconds in result['modules'].items():
+                times[name] = min(times.get(name, seconds), seconds)
+        print 'import %-18s %8.1fms' % (module, 1000 * min(totals))
+        for name, seconds in sorted(times.items(),
+                                    key=lambda i: -i[1])[:slowest]:
+            print '  %-24s %8.1fms' % (name, 1000 * seconds)
+
+    for name, args in [
+        ('kanimaji.py --help', [sys.executable,
+                                os.path.join(here, 'kanimaji.py'), '--help']),
+        ('python alone', [sys.executable, '-c', 'pass']),
+    ]:
+        print '%-25s %8.1fms' % (name, 1000 * min(
+            _run_seconds(args) for i in range(repeat)))
+
+
+def _kanji_files(files):
+    return files or sorted(glob.glob(os.path.join(CORPUS_DIR, '*.svg')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', choices=['rasterizers', 'timing',
+                                              'stages', 'startup'])
+    parser.add_argument('files', nargs='*', help='KanjiVG files to use')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='runs per file, the best one is kept')
+    parser.add_argument('--gif', action='store_true', default=False,
+                        help='also time the rasterization and encoding of '
+                             'the GIF frames')
+    parser.add_argument('--baseline', default=BASELINE_FILE,
+                        help='timings to compare to (default: %(default)s)')
+    parser.add_argument('--save-baseline', metavar='FILE',
+                        help='save the timings as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='slowdown reported as a regression')
+    args = parser.parse_args()
+
+    if args.benchmark == 'rasterizers':
+        bench_rasterizers(_kanji_files(args.files))
+    elif args.benchmark == 'timing':
+        bench_timing()
+    elif args.benchmark == 'stages':
+        baseline = args.baseline if os.path.exists(args.baseline) else None
+        if not bench_stages(
+                _kanji_files(args.files), args.repeat, args.gif, baseline, args.save_baseline,
+                args.tolerance):
+            sys.exit(1)
+    elif args.benchmark == 'startup':
+        bench_startup(args.repeat)
@@ -1,6 +1,9 @@
 
 import math
 
+# the array functions need NumPy, imported when they are first called so
+# that the scalar ones don't wait for it
+
 Infinity = float("inf")
 
 def thrt(x):
@@ -17,6 +20,11 @@ def cb(x):
 
 # x(t) = t^3 T + 3t^2(1-t) U + 3t(1-t)^2 V + (1-t)^3 W 
 def time(pt1, ct1, ct2, pt2, x):
+    # at the ends the solver may pick a root outside of the curve
+    if x <= pt1.x:
+        return 1.0
+    if x >= pt2.x:
+        return 0.0
     #var C = Cubic, a,b,c,d,p,q,lambda,sqlambda,tmp,addcoef,t,qb,qc,norm,angle,fact;
     a =  pt1.x  - 3*ct1.x + 3*ct2.x - pt2.x
     b = 3*ct1.x - 6*ct2.x + 3*pt2.x
@@ -61,6 +69,80 @@ def value(pt1, ct1, ct2, pt2, x):
     t = time(pt1, ct1, ct2, pt2, x);
     return cb(t)*pt1.y + 3*sq(t)*(1-t)*ct1.y + 3*t*sq(1-t)*ct2.y + cb(1-t)*pt2.y
 
+# The same, evaluating a whole array of x at once.
+# They compute exactly the same values as time() and value() above.
+
+def _sqrt_array(x):
+    import numpy
+    return numpy.where(x>0, numpy.sqrt(numpy.maximum(x, 0)), 0)
+
+def _thrt_array(x):
+    import numpy
+    return numpy.where(x>0, numpy.power(numpy.abs(x), 1.0/3),
+                       -numpy.power(numpy.abs(x), 1.0/3))
+
+def time_array(pt1, ct1, ct2, pt2, x):
+    import numpy
+    x = numpy.asarray(x, dtype=float)
+    t = _solve_array(pt1, ct1, ct2, pt2, x)
+    return numpy.where(x <= pt1.x, 1.0, numpy.where(x >= pt2.x, 0.0, t))
+
+def _solve_array(pt1, ct1, ct2, pt2, x):
+    import numpy
+    a =  pt1.x  - 3*ct1.x + 3*ct2.x - pt2.x
+    b = 3*ct1.x - 6*ct2.x + 3*pt2.x
+    c = 3*ct2.x - 3*pt2.x
+    d =  pt2.x  - x
+
+    if(abs(a) < 0.000000001): #quadratic
+        if(abs(b) < 0.000000001): #linear
+            return -d/c
+
+        qb = c/b
+        qc = d/b
+        tmp = _sqrt_array(sq(qb)-4*qc)
+        return (-qb + numpy.where((qb>0) | (qc<0), tmp, -tmp)) / 2
+
+    p = -sq(b)/(3*sq(a)) + c/a
+    q = 2*cb(b/(3*a)) - b*c/(3*sq(a)) + d/a
+    addcoef = -b/(3*a)
+
+    lmbd = sq(q)/4 + cb(p)/27
+    t = numpy.empty_like(x)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        real = lmbd >= 0
+        sqlambda = _sqrt_array(lmbd[real])
+        qr = q[real]
+        tmp = _thrt_array(-qr/2 + numpy.where(qr<0, sqlambda, -sqlambda))
+        t[real] = tmp - p/(3*tmp) + addcoef
+
+        qi = q[~real]
+        norm = _sqrt_array(sq(qi)/4 - lmbd[~real])
+        angle = numpy.arccos(-qi/(2*norm)) / 3
+        fact = 2 * _thrt_array(norm)
+        ti = numpy.full(len(qi), Infinity)
+        for i in range(-1, 2):
+            tmp = fact * numpy.cos(angle + i*math.pi*2/3) + addcoef
+            ti = numpy.where((tmp>=-0.000000001) & (tmp<ti), tmp, ti)
+        t[~real] = numpy.where(norm<0.0000000001, addcoef, ti)
+    return t
+
+def value_array(pt1, ct1, ct2, pt2, x):
+    t = time_array(pt1, ct1, ct2, pt2, x)
+    return cb(t)*pt1.y + 3*sq(t)*(1-t)*ct1.y + 3*t*sq(1-t)*ct2.y + cb(1-t)*pt2.y
+
+# Approximation by linear interpolation in a table of samples, much faster
+# when evaluating many values of the same curve.
+
+def value_table(pt1, ct1, ct2, pt2, samples=1024):
+    import numpy
+    x = numpy.linspace(0, 1, samples+1)
+    return x, value_array(pt1, ct1, ct2, pt2, x)
+
+def value_interp(table, x):
+    import numpy
+    return numpy.interp(x, *table)
+
 class pt:
     def __init__(self, x, y):
         self.x, self.y = x, y
@@ -0,0 +1,280 @@
+"""
+In process GIF encoding of the rasterized frames, instead of assembling
+them with ImageMagick and optimizing the result with gifsicle.
+
+All the frames share one global palette of 63 colours (plus a transparent
+entry), quantized from all the frames at once as `convert -map` was doing,
+or from a sample of them spread over long animations. Each frame then only
+stores the rectangle that changed since the previous one, with the pixels
+that didn't change inside it set to transparent, as `-layers OptimizePlus`
+does, and frames identical to the previous one are merged into it. Needs
+NumPy and Pillow.
+
+Frames are read one at a time, and those of long animations wait in a
+temporary file rather than in memory while the palette is made, so memory
+use doesn't grow with the number of frames.
+"""
+
+import struct
+import tempfile
+
+import numpy
+from PIL import (
+    Image,
+    ImageColor,
+)
+
+COLORS = 63
+TRANSPARENT = 63
+PALETTE_BITS = 6  # 2**6 palette entries, the colours and the transparency
+
+# disposal methods
+DISPOSE_NONE = 1
+DISPOSE_BACKGROUND = 2
+
+
+def lzw_encode(indices, min_code_size):
+    """Compresses a sequence of palette indices as GIF image data."""
+    clear = 1 << min_code_size
+    eoi = clear + 1
+    code_size = min_code_size + 1
+    next_code = eoi + 1
+    # codes of the strings seen so far, keyed by (prefix code << 8) | index
+    table = {}
+
+    out = bytearray()
+    acc = 0
+    nbits = 0
+
+    acc |= clear << nbits
+    nbits += code_size
+
+    it = iter(indices)
+    prefix = next(it, None)
+    if prefix is not None:
+        for index in it:
+            key = (prefix << 8) | index
+            code = table.get(key)
+            if code is not None:
+                prefix = code
+                continue
+            acc |= prefix << nbits
+            nbits += code_size
+            while nbits >= 8:
+                out.append(acc & 0xff)
+                acc >>= 8
+                nbits -= 8
+            if next_code < 4096:
+                table[key] = next_code
+                next_code += 1
+                if next_code > (1 << code_size):
+                    code_size += 1
+            else:
+                # table is full, start over
+                acc |= clear << nbits
+                nbits += code_size
+                table = {}
+                code_size = min_code_size + 1
+                next_code = eoi + 1
+            prefix = index
+        acc |= prefix << nbits
+        nbits += code_size
+
+    acc |= eoi << nbits
+    nbits += code_size
+    while nbits > 0:
+        out.append(acc & 0xff)
+        acc >>= 8
+        nbits -= 8
+
+    # split in sub-blocks of at most 255 bytes
+    blocks = bytearray([min_code_size])
+    for i in range(0, len(out), 255):
+        chunk = out[i:i+255]
+        blocks.append(len(chunk))
+        blocks += chunk
+    blocks.append(0)
+    return bytes(blocks)
+
+
+class GifWriter(object):
+    """Writes a looping animated GIF one frame at a time."""
+
+    def __init__(self, f, width, height, palette):
+        self.f = f
+        self.f.write(b'GIF89a')
+        # logical screen descriptor, followed by the global colour table
+        self.f.write(struct.pack('<HHBBB', width, height,
+                                 0x80 | 0x70 | (PALETTE_BITS - 1), 0, 0))
+        palette = list(palette)[:3 << PALETTE_BITS]
+        palette += [0] * ((3 << PALETTE_BITS) - len(palette))
+        self.f.write(bytes(bytearray(palette)))
+        # loop forever
+        self.f.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00')
+
+    def add_frame(self, indices, delay, offset=(0, 0),
+                  disposal=DISPOSE_NONE, transparent=None):
+        """
+        Adds a frame, given as a 2D array of palette indices to be drawn at
+        offset, shown for delay hundredths of a second.
+        """
+        height, width = indices.shape
+        flags = disposal << 2
+        if transparent is not None:
+            flags |= 1
+        self.f.write(struct.pack('<BBBBHBB', 0x21, 0xf9, 4, flags,
+                                 delay, transparent or 0, 0))
+        self.f.write(struct.pack('<BHHHHB', 0x2c, offset[0], offset[1],
+                                 width, height, 0))
+        self.f.write(lzw_encode(
+            bytearray(numpy.ascontiguousarray(indices, numpy.uint8).tobytes()),
+            PALETTE_BITS))
+
+    def close(self):
+        self.f.write(b'\x3b')
+
+
+def _flatten(images, background):
+    """
+    The RGB array of each of the frames, and its opaque pixels (None over a
+    background colour).
+    """
+    bg = None
+    for im in images:
+        if background == 'transparent':
+            rgba = numpy.asarray(im.convert('RGBA'))
+            yield rgba[..., :3], rgba[..., 3] >= 128
+            continue
+        if bg is None:
+            bg = Image.new('RGBA', im.size, ImageColor.getrgb(background))
+        yield numpy.asarray(Image.alpha_composite(bg, im.convert('RGBA'))
+                            .convert('RGB')), None
+
+
+def palette_sample(n, count):
+    """Indices of count of n frames spread evenly, or all if fewer."""
+    if n <= count:
+        return set(range(n))
+    return set(numpy.linspace(0, n - 1, count).round().astype(int).tolist())
+
+
+class FrameSpool(object):
+    """Flattened frames kept in a temporary file, read back in order."""
+
+    def __init__(self):
+        self.f = tempfile.TemporaryFile()
+        self.frames = []
+
+    def append(self, frame, opaque):
+        self.f.write(numpy.ascontiguousarray(frame).tobytes())
+        if opaque is not None:
+            self.f.write(numpy.ascontiguousarray(opaque).tobytes())
+        self.frames.append((frame.shape, opaque is not None))
+
+    def __iter__(self):
+        self.f.seek(0)
+        for shape, has_opaque in self.frames:
+            height, width, depth = shape
+            frame = numpy.frombuffer(self.f.read(height * width * depth),
+                                     numpy.uint8).reshape(shape)
+            opaque = None
+            if has_opaque:
+                opaque = numpy.frombuffer(self.f.read(height * width),
+                                          numpy.bool_).reshape(height, width)
+            yield frame, opaque
+
+    def close(self):
+        self.f.close()
+
+
+def shared_palette(frames):
+    """Palette image with the COLORS colours best representing all frames."""
+    n, height, width, _ = frames.shape
+    montage = Image.fromarray(numpy.ascontiguousarray(
+        frames.reshape(n * height, width, 3)))
+    quantized = montage.quantize(COLORS)
+    ncolors = max(index for count, index in quantized.getcolors()) + 1
+    palette = quantized.getpalette()[:3 * ncolors]
+    # pad with copies of the last colour, so they are never a better match
+    palette += palette[-3:] * (256 - ncolors)
+    image = Image.new('P', (1, 1))
+    image.putpalette(palette)
+    return image, ncolors
+
+
+def _remap(frame, palette, ncolors):
+    indices = numpy.asarray(Image.fromarray(frame).quantize(
+        palette=palette, dither=Image.NONE))
+    return numpy.minimum(indices, ncolors - 1).astype(numpy.uint8)
+
+
+def write_gif(f, images, delays, background, palette_frames=256):
+    """
+    Encodes the RGBA images (an iterable, eg. loading or rendering each
+    one in turn) as an animated GIF, each shown for the given delay in
+    hundredths of seconds, over the background colour (or with a
+    transparent background if it is 'transparent'). f is a file name, or a
+    file object to write to. The palette is quantized from palette_frames
+    of the images at most.
+    """
+    if isinstance(f, basestring):
+        with open(f, 'wb') as f:
+            return write_gif(f, images, delays, background, palette_frames)
+    sample = palette_sample(len(delays), palette_frames)
+    if len(sample) == len(delays):
+        # the palette is made from all of them anyway
+        frames = list(_flatten(images, background))
+        sampled = [frame for frame, opaque in frames]
+    else:
+        frames = FrameSpool()
+        sampled = []
+        for k, (frame, opaque) in enumerate(_flatten(images, background)):
+            frames.append(frame, opaque)
+            if k in sample:
+                sampled.append(frame)
+    try:
+        palette, ncolors = shared_palette(numpy.array(sampled))
+        height, width = sampled[0].shape[:2]
+        del sampled
+        _write_frames(f, frames, delays, width, height, palette, ncolors)
+    finally:
+        if isinstance(frames, FrameSpool):
+            frames.close()
+
+
+def _write_frames(f, frames, delays, width, height, palette, ncolors):
+    writer = GifWriter(f, width, height, palette.getpalette())
+    previous = None
+    pending = None  # the last frame is only written once its delay is known
+    for k, (frame, opaque) in enumerate(frames):
+        indices = _remap(frame, palette, ncolors)
+        if opaque is not None:
+            # no frame differencing with a transparent background, as
+            # pixels may need to become transparent again
+            indices[~opaque] = TRANSPARENT
+            if pending is not None:
+                writer.add_frame(*pending)
+            pending = [indices, delays[k], (0, 0),
+                       DISPOSE_BACKGROUND, TRANSPARENT]
+            continue
+
+        if previous is None:
+            pending = [indices, delays[k], (0, 0), DISPOSE_NONE, None]
+            previous = indices
+            continue
+        changed = indices != previous
+        if not changed.any():
+            # same as the previous frame, just show that one longer
+            pending[1] += delays[k]
+            continue
+        rows = numpy.flatnonzero(changed.any(axis=1))
+        cols = numpy.flatnonzero(changed.any(axis=0))
+        y0, y1 = rows[0], rows[-1] + 1
+        x0, x1 = cols[0], cols[-1] + 1
+        patch = indices[y0:y1, x0:x1].copy()
+        patch[~changed[y0:y1, x0:x1]] = TRANSPARENT
+        writer.add_frame(*pending)
+        pending = [patch, delays[k], (x0, y0), DISPOSE_NONE, TRANSPARENT]
+        previous = indices
+    writer.add_frame(*pending)
+    writer.close()
@@ -0,0 +1,38 @@
+"""
+State of every stroke at every GIF frame, computed at once with NumPy.
+
+Strokes are drawn one after the other, each one taking its duration: at a
+given frame a stroke is either not started yet, being drawn (and how far
+along, after the timing function), or done.
+"""
+
+import numpy
+
+PENDING = 0
+DRAWING = 1
+DRAWN = 2
+
+
+class StrokeTimeline(object):
+    """
+    states and progressions are (frames x strokes) arrays, progressions
+    being only meaningful where the stroke is DRAWING. timing_func maps an
+    array of fractions of stroke durations to their progressions.
+    """
+
+    def __init__(self, durations, frame_times, timing_func):
+        durations = numpy.asarray(durations, dtype=float)
+        frame_times = numpy.asarray(frame_times, dtype=float)[:, None]
+        ends = numpy.cumsum(durations)
+        starts = numpy.concatenate([[0.0], ends[:-1]])
+
+        self.states = numpy.full((len(frame_times), len(durations)),
+                                 DRAWING, dtype=numpy.int8)
+        self.states[frame_times < starts] = PENDING
+        self.states[frame_times > ends] = DRAWN
+
+        drawing = self.states == DRAWING
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            interval = (frame_times - starts) / (ends - starts)
+        self.progressions = numpy.zeros(self.states.shape)
+        self.progressions[drawing] = timing_func(interval[drawing])
@@ -3,89 +3,465 @@
 
 import argparse
 import glob
+import gzip
+import hashlib
+import importlib
 import json
 import math
 import os
 import re
+import signal
 import sys
+import timeit
+from multiprocessing import (
+    Pool,
+    cpu_count,
+)
+from contextlib import contextmanager
 from copy import deepcopy
+from io import BytesIO
 from os.path import (
-    abspath,
     basename,
 )
 from textwrap import dedent as d
 
 from lxml import etree
 from lxml.builder import E
-from tqdm import tqdm
 
-import bezier_cubic
+from length_cache import (
+    LengthCache,
+    svg_path_version,
+)
+from manifest import (
+    BuildManifest,
+    file_hash,
+)
+from minify import (
+    minify_css,
+    minify_template,
+    minify_values,
+    percent_decimals,
+)
+from rasterize import (
+    frame_files,
+    frame_images,
+    get_rasterizer,
+)
+import settings
 from settings import *
-from svg.path import parse_path
+from skeleton import (
+    DocumentSkeleton,
+    attribute_slot,
+    escape_text,
+    format_attributes,
+    line_slot,
+    text_slot,
+)
+import timing
+from tools import (
+    Step,
+    ToolScheduler,
+    is_external,
+    run_steps,
+    tool_step,
+)
+
+
+# modules needing NumPy, Pillow or brotli, which may not be installed, and
+# are imported when first used rather than by every command or worker:
+#  * arclength, without it lengths are measured by svg.path;
+#  * gif_frames and gif_encoder, for GIFs and the native encoder;
+#  * stroke_index, for --index;
+#  * brotli, for --brotli.
+_optional_modules = {}
+
+
+def optional_module(name):
+    """The module name, or None if it or what it needs isn't installed."""
+    try:
+        return _optional_modules[name]
+    except KeyError:
+        pass
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        module = None
+    _optional_modules[name] = module
+    return module
+
+
+class Settings(object):
+    """
+    The settings of an animation: those of settings.py, with the given
+    keyword arguments replacing them, eg. Settings(SHOW_BRUSH=False).
+    They are read only, and equal settings hash the same, so that they can
+    be part of the keys of a cache of rendered animations.
+    """
+
+    FUNCTIONS = ('stroke_length_to_duration', 'time_rescale')
+
+    def __init__(self, **overrides):
+        names = [name for name in dir(settings)
+                 if name.isupper() and not name.startswith('_')]
+        values = dict((name, getattr(settings, name))
+                      for name in names + list(self.FUNCTIONS))
+        for name, value in overrides.items():
+            if name not in values:
+                raise TypeError('unknown setting %s' % name)
+            values[name] = value
+        self.__dict__.update(values)
+        self.__dict__['_names'] = tuple(sorted(values))
+        # invalid settings are reported here rather than while rendering
+        self.__dict__['timing_function'] = timing.parse(self.TIMING_FUNCTION)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('settings are read only')
+
+    def items(self):
+        return [(name, self.__dict__[name]) for name in self._names]
+
+    def _key(self):
+        key = []
+        for name, value in self.items():
+            if callable(value) and hasattr(value, '__code__'):
+                value = (value.__code__.co_code, value.__code__.co_consts)
+            elif isinstance(value, dict):
+                value = tuple(sorted(value.items()))
+            key.append((name, value))
+        return tuple(key)
+
+    def __eq__(self, other):
+        return isinstance(other, Settings) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+
+_default_settings = None
+
+
+def default_settings():
+    """The settings of settings.py, used by the command line."""
+    global _default_settings
+    if _default_settings is None:
+        _default_settings = Settings()
+    return _default_settings
+
+
+PATH_LENGTH_ERROR = 1e-8
+
+_length_cache = None
+
+
+def get_length_cache():
+    global _length_cache
+    if _length_cache is None and LENGTH_CACHE_FILE:
+        _length_cache = LengthCache(LENGTH_CACHE_FILE,
+                                    'svg.path ' + svg_path_version())
+    return _length_cache
+
+
+def _svg_path_len(path):
+    from svg.path import parse_path
+    return parse_path(path).length(error=PATH_LENGTH_ERROR)
+
+
+def length_method(s):
+    """Identifies how lengths are measured with the Settings s."""
+    arclength = optional_module('arclength')
+    if s.PATH_LENGTH_ENGINE == 'quadrature' and arclength is not None:
+        return ('quadrature', arclength.ORDER, s.PATH_LENGTH_TOLERANCE)
+    return PATH_LENGTH_ERROR
+
+
+def compute_path_lens(paths, s, cache=None):
+    """
+    Lengths of a list of path data strings, measured in a single batch,
+    and looked up in and added to the LengthCache cache if any.
+    """
+    # identifies lengths measured this way in the cache
+    method = length_method(s)
+
+    if cache is not None:
+        lengths = [cache.get(path, method) for path in paths]
+    else:
+        lengths = [None] * len(paths)
+    missing = [i for i, length in enumerate(lengths) if length is None]
+    if not missing:
+        return lengths
+
+    todo = [paths[i] for i in missing]
+    if method == PATH_LENGTH_ERROR:
+        computed = [_svg_path_len(path) for path in todo]
+    else:
+        computed = optional_module('arclength').path_lengths(todo, s.PATH_LENGTH_TOLERANCE,
+                                          fallback=_svg_path_len)
+    for i, path, length in zip(missing, todo, computed):
+        lengths[i] = length
+        if cache is not None:
+            cache.put(path, method, length)
+    return lengths
+
+
+@contextmanager
+def timed(times, stage):
+    """Adds the time spent in the block to times[stage], if times isn't None."""
+    if times is None:
+        yield
+        return
+    start = timeit.default_timer()
+    try:
+        yield
+    finally:
+        times[stage] = times.get(stage, 0) + timeit.default_timer() - start
 
 
 def compute_path_len(path):
-    return parse_path(path).length(error=1e-8)
+    return compute_path_lens([path], default_settings(),
+                             get_length_cache())[0]
 
 
-def shescape(path):
-    return "'"+re.sub(r"(?=['\\\\])","\\\\",path)+"'"
+# we will need this to deal with svg
+namespaces = {'n': "http://www.w3.org/2000/svg"}
+parser = etree.XMLParser(remove_blank_text=True)
+# registered once, lxml keeps it for the whole process
+etree.register_namespace("xlink","http://www.w3.org/1999/xlink")
+# for the modes only measuring the strokes, the comments aren't needed
+strokes_parser = etree.XMLParser(remove_blank_text=True, remove_comments=True)
+
+# compiled once rather than at each call
+_top_styles = etree.XPath('/n:svg/n:style', namespaces=namespaces)
+_top_groups = etree.XPath('/n:svg/n:g', namespaces=namespaces)
+_group_paths = etree.XPath('.//n:path', namespaces=namespaces)
+
+
+class Stroke(object):
+    """A stroke path, with its geometry computed once per document."""
+
+    def __init__(self, id, d, length, duration):
+        self.id = id
+        self.d = d
+        self.length = length
+        self.duration = duration
+        self._path = None
+
+    @property
+    def path(self):
+        # only parsed on demand, a cached length doesn't need it
+        if self._path is None:
+            from svg.path import parse_path
+            self._path = parse_path(self.d)
+        return self._path
+
+
+class StrokeGroup(object):
+    """A top level group of the document, and the strokes it contains."""
+
+    def __init__(self, id, strokes):
+        self.id = id
+        self.is_stroke_numbers = bool(
+            re.match(r'^kvg:StrokeNumbers_', self.id))
+        self.strokes = strokes
+
+
+def stroke_elements(top):
+    """The top level groups top of a document, with the paths in each."""
+    elements = []
+    for g in top:
+        if re.match(r'^kvg:StrokeNumbers_', g.get('id')):
+            elements.append((g, []))
+        else:
+            elements.append((g, _group_paths(g)))
+    return elements
+
 
+def load_stroke_groups(doc, s, cache=None, top=None):
+    """
+    The StrokeGroups of the document, top being its top level groups if
+    already found.
+    """
+    elements = stroke_elements(_top_groups(doc) if top is None else top)
 
-# ease, ease-in, etc:
-# https://developer.mozilla.org/en-US/docs/Web/CSS/timing-function#ease
-pt1 = bezier_cubic.pt(0,0)
-ease_ct1 = bezier_cubic.pt(0.25, 0.1)
-ease_ct2 = bezier_cubic.pt(0.25, 1.0)
-ease_in_ct1 = bezier_cubic.pt(0.42, 0.0)
-ease_in_ct2 = bezier_cubic.pt(1.0, 1.0)
-ease_in_out_ct1 = bezier_cubic.pt(0.42, 0.0)
-ease_in_out_ct2 = bezier_cubic.pt(0.58, 1.0)
-ease_out_ct1 = bezier_cubic.pt(0.0, 0.0)
-ease_out_ct2 = bezier_cubic.pt(0.58, 1.0)
-pt2 = bezier_cubic.pt(1,1)
+    # measure all the strokes of the document at once
+    lengths = iter(compute_path_lens(
+        [p.get('d') for g, paths in elements for p in paths], s, cache))
 
+    def stroke(p):
+        length = next(lengths)
+        return Stroke(p.get('id'), p.get('d'), length,
+                      s.stroke_length_to_duration(length))
+    return [StrokeGroup(g.get('id'), [stroke(p) for p in paths])
+            for g, paths in elements]
 
-def linear(x):
-    return x
 
+_stroke_index = None
 
-def ease(x):
-    return bezier_cubic.value(pt1, ease_ct1, ease_ct2, pt2, x)
 
+def get_stroke_index():
+    """The StrokeIndex loaded by update_stroke_index(), if any."""
+    return _stroke_index
 
-def ease_in(x):
-    return bezier_cubic.value(pt1, ease_in_ct1, ease_in_ct2, pt2, x)
 
+def stroke_index_key(s):
+    """What the lengths and durations in the stroke index depend on."""
+    code = s.stroke_length_to_duration.__code__
+    return '%r %r %r' % (length_method(s), code.co_code, code.co_consts)
 
-def ease_in_out(x):
-    return bezier_cubic.value(pt1, ease_in_out_ct1, ease_in_out_ct2, pt2, x)
 
+def indexed_stroke_groups(name):
+    """The stroke groups of the file name from the stroke index, or None."""
+    if _stroke_index is None:
+        return None
+    rows = _stroke_index.get(name)
+    if rows is None:
+        return None
+    return [StrokeGroup(group_id, [Stroke(*stroke) for stroke in strokes])
+            for group_id, strokes in rows]
 
-def ease_out(x):
-    return bezier_cubic.value(pt1, ease_out_ct1, ease_out_ct2, pt2, x)
 
+def file_stroke_groups(svg_path, s):
+    """The stroke groups of a KanjiVG file, from the index if there."""
+    groups = indexed_stroke_groups(basename(svg_path))
+    if groups is None:
+        doc = etree.parse(svg_path, strokes_parser)
+        groups = load_stroke_groups(doc, s, get_length_cache())
+        if get_length_cache() is not None:
+            get_length_cache().flush()
+    return groups
 
-timing_funcs = {
-    'linear': linear,
-    'ease': ease,
-    'ease-in': ease_in,
-    'ease-in-out': ease_in_out,
-    'ease-out': ease_out,
+
+def animation_times(strokes, s):
+    """
+    The total time of the strokes scaled to include the wait after them,
+    the time the animation draws them and its whole time, in seconds.
+    """
+    tottime = sum(stroke.duration for stroke in strokes)
+
+    animation_time = s.time_rescale(tottime) #math.pow(3 * tottime, 2.0/3)
+    tottime += s.WAIT_AFTER * tottime / animation_time
+    actual_animation_time = animation_time
+    animation_time += s.WAIT_AFTER
+    return tottime, actual_animation_time, animation_time
+
+
+def timeline_record(groups, s):
+    """
+    The packed stroke timeline of the stroke groups of a document, see
+    timeline.py, with the strokes flattened if s.TIMELINE_POLYLINES.
+    """
+    import timeline
+    strokes = [stroke for g in groups for stroke in g.strokes]
+    tottime, actual_animation_time, animation_time = animation_times(strokes,
+                                                                     s)
+    return timeline.pack_record(
+        animation_time, [stroke.length for stroke in strokes],
+        # the data-duration of the JS-SVG strokes
+        [stroke.duration * tottime / animation_time for stroke in strokes],
+        [timeline.flatten(stroke.path, s.TIMELINE_POLYLINE_STEP)
+         for stroke in strokes] if s.TIMELINE_POLYLINES else None)
+
+
+# output type: (sub-directory of OUTPUT_DIR, suffix of the file name)
+OUTPUT_TYPES = {
+    'svg': ('svg', '_anim.svg'),
+    'js_svg': ('js_svg', '_js_anim.svg'),
+    'gif': ('gif', '_anim.gif'),
+    'timeline': ('timeline', '.timeline'),
 }
 
-if not TIMING_FUNCTION in timing_funcs:
-    exit('Sorry, invalid timing function "%s"', TIMING_FUNCTION)
-my_timing_func = timing_funcs[TIMING_FUNCTION]
+# the stroke timelines of all the kanji are packed in this single file
+TIMELINE_FILE = 'kanjivg'
+# its source in the build manifest, the whole corpus
+CORPUS_SOURCE = '*'
+
+# bump when a change in the code changes the files generated, so that
+# incremental builds regenerate them
+GENERATOR_VERSIONS = {
+    'svg': 3,
+    'js_svg': 3,
+    'gif': 3,
+    'timeline': 1,
+}
 
-# we will need this to deal with svg
-namespaces = {'n': "http://www.w3.org/2000/svg"}
-etree.register_namespace("xlink","http://www.w3.org/1999/xlink")
-parser = etree.XMLParser(remove_blank_text=True)
+# settings that don't change what is generated
+_BUILD_IRRELEVANT_SETTINGS = set([
+    'KANJIVG_SVG_DIR',
+    'OUTPUT_DIR',
+    'LENGTH_CACHE_FILE',
+    'DELETE_TEMPORARY_FILES',
+    'GIF_TOOL_JOBS',
+    'GIF_SVGEXPORT_BATCH',
+    'GIF_TOOL_MEMORY_LIMIT',
+    'STROKE_INDEX_FILE',
+])
+
+
+# compression of the sidecar files: suffix
+COMPRESSED_SUFFIXES = {
+    'gzip': '.gz',
+    'brotli': '.br',
+}
+
+
+def output_path(filename, output_type):
+    subdir, suffix = OUTPUT_TYPES[output_type]
+    filename_noext = re.sub(r'\.[^\.]+$','',basename(filename))
+    return os.path.join(OUTPUT_DIR, subdir, filename_noext + suffix)
+
+
+def output_files(filename, output_type, compress=()):
+    """All the files written for an output, including compressed ones."""
+    path = output_path(filename, output_type)
+    if output_type == 'gif':
+        # already compressed
+        return [path]
+    return [path] + [path + COMPRESSED_SUFFIXES[c] for c in compress]
+
+
+def write_output(path, data, compress=(), times=None):
+    """Writes an output file, and its compressed sidecars."""
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        pass
+    with timed(times, 'write'), open(path, 'wb') as f:
+        f.write(data)
+    with timed(times, 'compress'):
+        if 'gzip' in compress:
+            # no name nor time in the header, the same data always
+            # compresses to the same file
+            with open(path + '.gz', 'wb') as f:
+                with gzip.GzipFile('', 'wb', 9, f, mtime=0) as gz:
+                    gz.write(data)
+        if 'brotli' in compress:
+            with open(path + '.br', 'wb') as f:
+                f.write(optional_module('brotli').compress(data))
+
+
+def settings_hash(output_type, minify=False, s=None):
+    """Hash of the settings values affecting the given type of output."""
+    h = hashlib.sha1()
+    if minify and output_type != 'gif':
+        h.update('minify')
+    for name, value in (s or default_settings()).items():
+        if (name in _BUILD_IRRELEVANT_SETTINGS or
+                (name.startswith('GIF_') and output_type != 'gif') or
+                (name.startswith('TIMELINE_') and output_type != 'timeline')):
+            continue
+        if callable(value) and hasattr(value, '__code__'):
+            code = value.__code__
+            h.update('%s=%r%r' % (name, code.co_code, code.co_consts))
+        else:
+            h.update('%s=%r' % (name, value))
+    return h.hexdigest()
 
 
 def _sanity_check_gif(generate_gif):
-    if generate_gif and GIF_BACKGROUND_COLOR == 'transparent' and not GIF_ALLOW_TRANSPARENT:
+    s = default_settings()
+    if generate_gif and s.GIF_BACKGROUND_COLOR == 'transparent' and not s.GIF_ALLOW_TRANSPARENT:
         exit(d("""
         ******************************************************************
         WARNING: "transparent" not allowed by default as gif background,
@@ -95,490 +471,1169 @@ def _sanity_check_gif(generate_gif):
         """))
 
 
-def create_animation(
-    filename,
-    generate_svg=True,
-    generate_js_svg=False,
-    generate_gif=False,
-):
-    _sanity_check_gif(generate_gif)
+# CSS templates, dedented once and filled with the values of each stroke
 
-    filename_noext = re.sub(r'\.[^\.]+$','',filename)
-    filename_noext_ascii = re.sub(r'\\([\\u])','\\1',
-                            json.dumps(filename_noext))[1:-1]
-    baseid = basename(filename_noext_ascii)
+CSS_HEADER = d("""
+    /* CSS automatically generated by kanimaji.py, do not edit! */
+    """)
+
+JS_SVG_HEADER = CSS_HEADER + d("""
+    .backward {
+        animation-direction: reverse !important;
+    }
+    """)
+
+STROKE_NUMBERS_CSS = d("""
+    #%(gidcss)s {
+        display: none;
+    }""")
+
+GROUP_CSS = d("""
+    #%(gidcss)s {
+        stroke-width: %(width).01fpx !important;
+        stroke:       %(color)s !important;
+    }""")
+
+# animation stroke progression, visibility, and progression
+SVG_STROKE_CSS = d("""
+    @keyframes strike-%(pathname)s {
+        0%% { stroke-dashoffset: %(pathlen).03f; }
+        %(start).03f%% { stroke-dashoffset: %(pathlen).03f; }
+        %(end).03f%% { stroke-dashoffset: 0; }
+        100%% { stroke-dashoffset: 0; }
+    }
+    @keyframes showhide-%(pathname)s {
+        %(start).03f%% { visibility: hidden; }
+        %(end).03f%% { stroke: %(filling_color)s; }
+    }
+    #%(anim)s {
+        stroke-dasharray: %(pathlen).03f %(pathlen).03f;
+        stroke-dashoffset: 0;
+        animation: strike-%(pathname)s %(animation_time).03fs %(timing)s infinite,
+            showhide-%(pathname)s %(animation_time).03fs step-start infinite;
+    }""")
+
+# brush element visibility, and progression
+SVG_BRUSH_CSS = d("""
+    @keyframes showhide-brush-%(pathname)s {
+        %(start).03f%% { visibility: hidden; }
+        %(end).03f%% { visibility: visible; }
+        100%% { visibility: hidden; }
+    }
+    #%(brush)s, #%(brush_brd)s {
+        stroke-dasharray: 0 %(pathlen).03f;
+        animation: strike-%(pathname)s %(animation_time).03fs %(timing)s infinite,
+            showhide-brush-%(pathname)s %(animation_time).03fs step-start infinite;
+    }""")
+
+JS_SVG_COMMENT = d("""\n
+    /* stroke %(pathid)s */""")
+
+# brush and background hidden by default
+JS_SVG_BRUSH_HIDDEN_CSS = d("""
+    #%(brush)s, #%(brush_brd)s, #%(bg)s {
+        visibility: hidden;
+    }""")
+
+# hide stroke after current element, and show bg after current element,
+# or if animated, then the stroke progression
+JS_SVG_STROKE_CSS = d("""
+    [class *= "current"] ~ #%(anim)s {
+        visibility: hidden;
+    }
+    [class *= "current"] ~ #%(bg)s, #%(bg)s.animate {
+        visibility: visible;
+    }
+    @keyframes strike-%(pathname)s {
+        0%% { stroke-dashoffset: %(pathlen).03f; }
+        100%% { stroke-dashoffset: 0; }
+    }
+    #%(anim)s.animate {
+        stroke: %(filling_color)s;
+        stroke-dasharray: %(pathlen).03f %(pathlen).03f;
+        visibility: visible;
+        animation: strike-%(pathname)s %(relduration).03fs %(timing)s forwards 1;
+    }""")
+
+JS_SVG_BRUSH_CSS = d("""
+    @keyframes strike-brush-%(pathname)s {
+        0%% { stroke-dashoffset: %(pathlen).03f; }
+        100%% { stroke-dashoffset: 0.4; }
+    }
+    #%(brush)s.animate.brush, #%(brush_brd)s.animate.brush {
+        stroke-dasharray: 0 %(pathlen).03f;
+        visibility: visible;
+        animation: strike-brush-%(pathname)s %(relduration).03fs %(timing)s forwards 1;
+    }""")
+
+GIF_COMMENT = d("""
+    /* stroke %(pathid)s */
+    """)
 
-    # load xml
-    doc = etree.parse(filename, parser)
+GIF_HIDDEN_CSS = d("""
+    %s {
+        visibility: hidden;
+    }""")
+
+# the offset is only known for each frame, it stays a placeholder
+GIF_DRAWING_CSS = d("""
+    #%(anim)s {
+        stroke-dasharray: %(pathlen).03f %(pathlen_gap).03f;
+        stroke-dashoffset: %%(offset)s;
+        stroke: %(filling_color)s;
+    }""")
+
+GIF_BRUSH_DRAWING_CSS = d("""
+    #%(brush)s, #%(brush_brd)s {
+        stroke-dasharray: 0.001 %(pathlen_gap).03f;
+        stroke-dashoffset: %%(offset)s;
+    }""")
+
+
+# With SHARED_CSS, the rules that are the same for all kanji are written
+# once to this file next to the SVGs, which import it. The lengths and
+# durations of the strokes are passed to them in custom properties, set on
+# the kanji's own elements so that SVGs inlined in the same page don't
+# override each other's.
+SHARED_CSS_FILE = 'kanimaji.css'
+
+SHARED_CSS_HEADER = d("""
+    /* CSS automatically generated by kanimaji.py, do not edit! */
+    @import url(%s);
+    """ % SHARED_CSS_FILE)
+
+SHARED_GROUP_CSS = d("""
+    [id^="kvg:StrokeNumbers_"] {
+        display: none;
+    }
+    [id^="kvg:StrokePaths_"] {
+        stroke-width: %(width).01fpx !important;
+        stroke:       %(color)s !important;
+    }""")
+
+SHARED_SVG_STROKE_CSS = d("""
+    [id$="-anim-Kanimaji"] > use {
+        stroke-dasharray: var(--len) var(--len);
+        stroke-dashoffset: 0;
+        animation-duration: var(--time);
+        animation-timing-function: %(timing)s, step-start;
+        animation-iteration-count: infinite;
+    }""")
+
+SHARED_SVG_BRUSH_CSS = d("""
+    [id$="-brush-Kanimaji"] > use, [id$="-brush-brd-Kanimaji"] > use {
+        stroke-dasharray: 0 var(--len);
+        animation-duration: var(--time);
+        animation-timing-function: %(timing)s, step-start;
+        animation-iteration-count: infinite;
+    }""")
+
+SHARED_JS_SVG_STROKE_CSS = d("""
+    @keyframes kanimaji-strike {
+        0%% { stroke-dashoffset: var(--len); }
+        100%% { stroke-dashoffset: 0; }
+    }
+    [id$="-anim-Kanimaji"] > use.animate {
+        stroke: %(filling_color)s;
+        stroke-dasharray: var(--len) var(--len);
+        animation: kanimaji-strike var(--duration) %(timing)s forwards 1;
+    }""")
+
+SHARED_JS_SVG_BRUSH_CSS = d("""
+    @keyframes kanimaji-strike-brush {
+        0%% { stroke-dashoffset: var(--len); }
+        100%% { stroke-dashoffset: 0.4; }
+    }
+    [id$="-brush-Kanimaji"] > use.animate.brush,
+    [id$="-brush-brd-Kanimaji"] > use.animate.brush {
+        stroke-dasharray: 0 var(--len);
+        animation: kanimaji-strike-brush var(--duration) %(timing)s forwards 1;
+    }""")
+
+ANIMATION_TIME_CSS = d("""
+    %(groups)s {
+        --time: %(animation_time).03fs;
+    }""")
+
+COMPACT_SVG_STROKE_CSS = d("""
+    @keyframes strike-%(pathname)s {
+        0%%, %(start).03f%% { stroke-dashoffset: var(--len); }
+        %(end).03f%%, 100%% { stroke-dashoffset: 0; }
+    }
+    @keyframes showhide-%(pathname)s {
+        %(start).03f%% { visibility: hidden; }
+        %(end).03f%% { stroke: %(filling_color)s; }
+    }
+    #%(anim)s {
+        --len: %(pathlen).03f;
+        animation-name: strike-%(pathname)s, showhide-%(pathname)s;
+    }""")
+
+COMPACT_SVG_BRUSH_CSS = d("""
+    @keyframes showhide-brush-%(pathname)s {
+        %(start).03f%% { visibility: hidden; }
+        %(end).03f%% { visibility: visible; }
+        100%% { visibility: hidden; }
+    }
+    #%(brush)s, #%(brush_brd)s {
+        --len: %(pathlen).03f;
+        animation-name: strike-%(pathname)s, showhide-brush-%(pathname)s;
+    }""")
+
+COMPACT_JS_SVG_STROKE_CSS = d("""
+    [class *= "current"] ~ #%(anim)s {
+        visibility: hidden;
+    }
+    [class *= "current"] ~ #%(bg)s, #%(bg)s.animate {
+        visibility: visible;
+    }
+    #%(anim)s.animate {
+        --len: %(pathlen).03f;
+        --duration: %(relduration).03fs;
+        visibility: visible;
+    }""")
+
+COMPACT_JS_SVG_BRUSH_CSS = d("""
+    #%(brush)s.animate.brush, #%(brush_brd)s.animate.brush {
+        --len: %(pathlen).03f;
+        --duration: %(relduration).03fs;
+        visibility: visible;
+    }""")
+
+
+def shared_css(output_type, s):
+    """The style sheet imported by all the files of output_type."""
+    values = {'width': s.STOKE_BORDER_WIDTH, 'color': s.STOKE_BORDER_COLOR,
+              'timing': s.timing_function.css,
+              'filling_color': s.STOKE_FILLING_COLOR}
+    if output_type == 'svg':
+        css = [CSS_HEADER, SHARED_GROUP_CSS % values,
+               SHARED_SVG_STROKE_CSS % values]
+        if s.SHOW_BRUSH:
+            css.append(SHARED_SVG_BRUSH_CSS % values)
+    else:
+        css = [JS_SVG_HEADER, SHARED_GROUP_CSS % values,
+               SHARED_JS_SVG_STROKE_CSS % values]
+        if s.SHOW_BRUSH:
+            css.append(SHARED_JS_SVG_BRUSH_CSS % values)
+    return ''.join(css) + '\n'
+
+
+def write_shared_css(output_type, minify=False, compress=()):
+    subdir, suffix = OUTPUT_TYPES[output_type]
+    css = shared_css(output_type, default_settings())
+    if minify:
+        css = minify_css(css)
+    write_output(os.path.join(OUTPUT_DIR, subdir, SHARED_CSS_FILE), css,
+                 compress)
+
+
+_minified_templates = {}
+
+
+def _template(template, minify):
+    """The template, minified (once) with --minify."""
+    if not minify:
+        return template
+    if template not in _minified_templates:
+        _minified_templates[template] = minify_template(template)
+    return _minified_templates[template]
+
+
+def _css_values(stroke_values, animation_time, minify):
+    """The values of the strokes, with the numbers shortened to fill
+    minified templates."""
+    if not minify:
+        return stroke_values
+    decimals = {'start': percent_decimals(animation_time),
+                'end': percent_decimals(animation_time),
+                'animation_time': 3, 'relduration': 3}
+    return [minify_values(v, decimals) for v in stroke_values]
+
+
+def _group_css(g, s, shared=False, minify=False):
+    if shared and re.match(r'^kvg:Stroke(Numbers|Paths)_', g.id):
+        # covered by SHARED_GROUP_CSS
+        return ''
+    gidcss = re.sub(r':', '\\\\3a ', g.id)
+    if g.is_stroke_numbers:
+        return _template(STROKE_NUMBERS_CSS, minify) % {'gidcss': gidcss}
+    values = {'gidcss': gidcss, 'width': s.STOKE_BORDER_WIDTH,
+              'color': s.STOKE_BORDER_COLOR}
+    if minify:
+        values = minify_values(values, {})
+    return _template(GROUP_CSS, minify) % values
+
+
+def _group_strokes_values(groups, stroke_values):
+    """Pairs each group with the values of its strokes."""
+    stroke_values = iter(stroke_values)
+    for g in groups:
+        yield g, [next(stroke_values) for stroke in g.strokes]
+
+
+def svg_css(baseid, groups, stroke_values, animation_time, s,
+            minify=False):
+    """The style sheet of the animated SVG of baseid, in fragments."""
+    if s.SHARED_CSS:
+        templates = [COMPACT_SVG_STROKE_CSS, COMPACT_SVG_BRUSH_CSS]
+        yield _template(SHARED_CSS_HEADER, minify)
+        # the groups of the animated strokes, whose uses inherit the time
+        groups_css = ', '.join(
+            '#kvg\\3a %s-%s-Kanimaji' % (baseid, suffix)
+            for suffix in ['anim'] + (['brush', 'brush-brd']
+                                      if s.SHOW_BRUSH else []))
+        yield _template(ANIMATION_TIME_CSS, minify) % _css_values(
+            [{'groups': groups_css, 'animation_time': animation_time}],
+            animation_time, minify)[0]
+    else:
+        templates = [SVG_STROKE_CSS, SVG_BRUSH_CSS]
+        yield _template(CSS_HEADER, minify)
+    stroke_css, brush_css = [_template(t, minify) for t in templates]
+    stroke_values = _css_values(stroke_values, animation_time, minify)
+    for g, values in _group_strokes_values(groups, stroke_values):
+        yield _group_css(g, s, s.SHARED_CSS, minify)
+        for v in values:
+            yield stroke_css % v
+            if s.SHOW_BRUSH:
+                yield brush_css % v
+
+
+def js_svg_css(groups, stroke_values, animation_time, s, minify=False):
+    """The style sheet of the JS-SVG, in fragments."""
+    if s.SHARED_CSS:
+        templates = [COMPACT_JS_SVG_STROKE_CSS, COMPACT_JS_SVG_BRUSH_CSS]
+        yield _template(SHARED_CSS_HEADER, minify)
+    else:
+        templates = [JS_SVG_STROKE_CSS, JS_SVG_BRUSH_CSS]
+        yield _template(JS_SVG_HEADER, minify)
+    comment_css, brush_hidden_css, stroke_css, brush_css = [
+        _template(t, minify) for t in
+        [JS_SVG_COMMENT, JS_SVG_BRUSH_HIDDEN_CSS] + templates]
+    stroke_values = _css_values(stroke_values, animation_time, minify)
+    for g, values in _group_strokes_values(groups, stroke_values):
+        yield _group_css(g, s, s.SHARED_CSS, minify)
+        for v in values:
+            yield comment_css % v
+            if s.SHOW_BRUSH:
+                yield brush_hidden_css % v
+            yield stroke_css % v
+            if s.SHOW_BRUSH:
+                yield brush_css % v
+
+
+def gif_css_rules(groups, stroke_values, s):
+    """
+    The rules making the style sheet of every GIF frame, after CSS_HEADER:
+    strings are copied as they are, and strokes are tuples with the rules
+    used depending on their state at the frame time, (length, pending,
+    drawn, drawing), the offset of the stroke being drawn being filled in
+    for each frame.
+    """
+    for g, values in _group_strokes_values(groups, stroke_values):
+        yield _group_css(g, s)
+        for v in values:
+            comment = GIF_COMMENT % v
+            brush = ', #%(brush)s, #%(brush_brd)s' % v if s.SHOW_BRUSH else ''
+            # not started yet, just hide everything
+            pending_rule = comment + GIF_HIDDEN_CSS % ('#' + v['anim'] + brush)
+            # done, just hide the brush, and bg
+            drawn_rule = comment + GIF_HIDDEN_CSS % ('#' + v['bg'] + brush)
+            drawing_rule = comment + GIF_DRAWING_CSS % v
+            if s.SHOW_BRUSH:
+                drawing_rule += GIF_BRUSH_DRAWING_CSS % v
+            yield (v['pathlen'], pending_rule, drawn_rule, drawing_rule)
+
+
+class FrameDocuments(object):
+    """
+    The SVG documents of the GIF frames, each only made when iterated over
+    so that long animations aren't all in memory at once.
+    """
+
+    def __init__(self, head, tail, gif_rules, states, progressions):
+        self.head = head
+        self.tail = tail
+        self.gif_rules = gif_rules
+        self.states = states
+        self.progressions = progressions
+
+    def __len__(self):
+        return len(self.states)
+
+    def __iter__(self):
+        gif_frames = optional_module('gif_frames')
+        for states, progressions in zip(self.states, self.progressions):
+            css = [CSS_HEADER]
+            strokes_states = iter(zip(states, progressions))
+            for rule in self.gif_rules:
+                if isinstance(rule, basestring):
+                    css.append(rule)
+                    continue
+                pathlen, pending_rule, drawn_rule, drawing_rule = rule
+                state, progression = next(strokes_states)
+                if state == gif_frames.PENDING:
+                    css.append(pending_rule)
+                elif state == gif_frames.DRAWN:
+                    css.append(drawn_rule)
+                else:
+                    css.append(drawing_rule % {'offset': '%.04f' % (
+                        pathlen * (1-progression)+0.0015)})
+            yield self.head + escape_text(''.join(css)) + self.tail
+
+
+def gif_frame_documents(skeleton, gif_rules, strokes, tottime,
+                        animation_time, last_frame_index, s):
+    """The FrameDocuments of every GIF frame."""
+    import numpy
+    gif_frames = optional_module('gif_frames')
+    # state of each stroke at each frame
+    frame_times = (numpy.arange(last_frame_index+1) * s.GIF_FRAME_DURATION
+                   * tottime / animation_time) # unscaled time
+    timeline = gif_frames.StrokeTimeline(
+        [stroke.duration for stroke in strokes], frame_times,
+        lambda x: s.timing_function.array(x, s.GIF_TIMING_SAMPLES))
+
+    # only the style changes per frame
+    head, tail = skeleton.around('style', {})
+    return FrameDocuments(head, tail, gif_rules, timeline.states.tolist(),
+                          timeline.progressions.tolist())
+
+
+def build_animations(doc, baseid, s, outputs, minify=False, cache=None,
+                     times=None, groups=None):
+    """
+    Builds the animations of the KanjiVG document doc (which is modified)
+    in memory, with the Settings s. Returns a dict with, for each of the
+    outputs, the SVG data for 'svg' and 'js_svg', and for 'gif' the SVG
+    documents of the frames and their delays in hundredths of seconds.
+    Lengths are looked up in the LengthCache cache if any, unless the
+    stroke groups of the document are given, and the time spent in each
+    stage is added to the times dict if any.
+    """
+    if 'gif' in outputs and optional_module('gif_frames') is None:
+        raise RuntimeError('Generating GIFs needs NumPy')
 
     # for xlink namespace introduction
     doc.getroot().set('{http://www.w3.org/1999/xlink}used','')
 
     #clear all extra elements this program may have previously added
-    for el in doc.xpath("/n:svg/n:style", namespaces=namespaces):
-        if re.match( r'-Kanimaji$', g.get('id') ):
+    for el in _top_styles(doc):
+        if re.search(r'-Kanimaji$', el.get('id', '')):
             doc.getroot().remove(el)
-    for g in doc.xpath("/n:svg/n:g", namespaces=namespaces):
-        if re.match( r'-Kanimaji$', g.get('id') ):
+    doc.getroot().attrib.pop('data-num-strokes', None)
+    # the groups are only looked up once
+    top = []
+    for g in _top_groups(doc):
+        if re.search(r'-Kanimaji$', g.get('id', '')):
             doc.getroot().remove(g)
+        else:
+            top.append(g)
 
     # create groups with a copies (references actually) of the paths
     bg_g = E.g(id = 'kvg:'+baseid+'-bg-Kanimaji',
             style = ('fill:none;stroke:%s;stroke-width:%f;'+
                 'stroke-linecap:round;stroke-linejoin:round;') %
-                (STOKE_UNFILLED_COLOR, STOKE_UNFILLED_WIDTH) )
+                (s.STOKE_UNFILLED_COLOR, s.STOKE_UNFILLED_WIDTH) )
     anim_g = E.g(id = 'kvg:'+baseid+'-anim-Kanimaji',
             style = ('fill:none;stroke:%s;stroke-width:%f;'+
                 'stroke-linecap:round;stroke-linejoin:round;') %
-                (STOKE_FILLED_COLOR, STOKE_FILLED_WIDTH) )
-    if SHOW_BRUSH:
+                (s.STOKE_FILLED_COLOR, s.STOKE_FILLED_WIDTH) )
+    if s.SHOW_BRUSH:
         brush_g = E.g(id = 'kvg:'+baseid+'-brush-Kanimaji',
                 style = ('fill:none;stroke:%s;stroke-width:%f;'+
                 'stroke-linecap:round;stroke-linejoin:round;') %
-                (BRUSH_COLOR, BRUSH_WIDTH))
+                (s.BRUSH_COLOR, s.BRUSH_WIDTH))
         brush_brd_g = E.g(id = 'kvg:'+baseid+'-brush-brd-Kanimaji',
                 style = ('fill:none;stroke:%s;stroke-width:%f;'+
                 'stroke-linecap:round;stroke-linejoin:round;') %
-                (BRUSH_BORDER_COLOR, BRUSH_BORDER_WIDTH))
-
-    # compute total length and time, at first
-    totlen = 0
-    tottime = 0
-
-    for g in doc.xpath("/n:svg/n:g", namespaces=namespaces):
-        if re.match( r'^kvg:StrokeNumbers_', g.get('id') ):
-            continue
-        for p in g.xpath(".//n:path", namespaces=namespaces):
-            pathlen = compute_path_len(p.get('d'))
-            duration = stroke_length_to_duration(pathlen)
-            totlen += pathlen
-            tottime += duration
-
-    animation_time = time_rescale(tottime) #math.pow(3 * tottime, 2.0/3)
-    tottime += WAIT_AFTER * tottime / animation_time
-    actual_animation_time = animation_time
-    animation_time += WAIT_AFTER
-
-    css_header = d("""
-    /* CSS automatically generated by kanimaji.py, do not edit! */
-    """)
-    if generate_svg:
-        animated_css = css_header
-    if generate_js_svg:
-        js_animated_css = css_header + d("""
-            .backward {
-                animation-direction: reverse !important;
-            }
-            """)
-        js_anim_els = []  # collect the ids of animating elements
-        js_anim_time = [] # the time set (as default) for each animation
-    if generate_gif:
-        static_css = {}
-        last_frame_index = int(actual_animation_time/GIF_FRAME_DURATION)+1
-        for i in range(0, last_frame_index+1):
-            static_css[i] = css_header
-        last_frame_delay = animation_time - last_frame_index*GIF_FRAME_DURATION
-    elapsedlen = 0
+                (s.BRUSH_BORDER_COLOR, s.BRUSH_BORDER_WIDTH))
+
+    # the JS-SVG output starts each group with a stroke 0 marker
+    for g in [bg_g, anim_g] + ([brush_g, brush_brd_g] if s.SHOW_BRUSH else []):
+        line_slot(g, 0, 'first-stroke')
+
+    # compute the geometry of all strokes, and total length and time
+    if groups is None:
+        with timed(times, 'geometry'):
+            groups = load_stroke_groups(doc, s, cache, top)
+    strokes = [stroke for g in groups for stroke in g.strokes]
+    tottime, actual_animation_time, animation_time = animation_times(strokes,
+                                                                     s)
+
+    # the values filled in the CSS templates of each stroke
+    stroke_values = []
     elapsedtime = 0
-
-    # add css elements for all strokes
-    for g in doc.xpath("/n:svg/n:g", namespaces=namespaces):
-        groupid = g.get('id')
-        if re.match( r'^kvg:StrokeNumbers_', groupid ):
-            rule = d("""
-                #%s {
-                    display: none;
-                }""" % re.sub(r':', '\\\\3a ', groupid))
-            if generate_svg:
-                animated_css += rule
-            if generate_js_svg:
-                js_animated_css += rule
-            if generate_gif:
-                for k in static_css: static_css[k] += rule
-            continue
-
-        gidcss = re.sub(r':', '\\\\3a ', groupid)
-        rule = d("""
-            #%s {
-                stroke-width: %.01fpx !important;
-                stroke:       %s !important;
-            }""" % (gidcss, STOKE_BORDER_WIDTH, STOKE_BORDER_COLOR))
-        if generate_svg:
-            animated_css += rule
-        if generate_js_svg:
-            js_animated_css += rule
-        if generate_gif:
-            for k in static_css: static_css[k] += rule
-
-        for p in g.xpath(".//n:path", namespaces=namespaces):
-            pathid = p.get('id')
-            pathidcss = re.sub(r':', '\\\\3a ', pathid)
-
-            if generate_js_svg:
-                js_anim_els.append({})
-
-            bg_pathid = pathid+'-bg'
-            bg_pathidcss = pathidcss+'-bg'
-            ref = E.use(id = bg_pathid)
-            ref.set('{http://www.w3.org/1999/xlink}href','#'+pathid)
-            bg_g.append(ref)
-            if generate_js_svg:
-                js_anim_els[-1]["bg"] = ref
-
-            anim_pathid = pathid+'-anim'
-            anim_pathidcss = pathidcss+'-anim'
-            ref = E.use(id = anim_pathid)
-            ref.set('{http://www.w3.org/1999/xlink}href','#'+pathid)
-            anim_g.append(ref)
-            if generate_js_svg:
-                js_anim_els[-1]["anim"] = ref
-
-            if SHOW_BRUSH:
-                brush_pathid = pathid+'-brush'
-                brush_pathidcss = pathidcss+'-brush'
-                ref = E.use(id = brush_pathid)
-                ref.set('{http://www.w3.org/1999/xlink}href','#'+pathid)
-                brush_g.append(ref)
-                if generate_js_svg:
-                    js_anim_els[-1]["brush"] = ref
-
-                brush_brd_pathid = pathid+'-brush-brd'
-                brush_brd_pathidcss = pathidcss+'-brush-brd'
-                ref = E.use(id = brush_brd_pathid)
-                ref.set('{http://www.w3.org/1999/xlink}href','#'+pathid)
-                brush_brd_g.append(ref)
-                if generate_js_svg:
-                    js_anim_els[-1]["brush-brd"] = ref
-
-            pathname = re.sub(r'^kvg:','',pathid)
-            pathlen = compute_path_len(p.get('d'))
-            duration = stroke_length_to_duration(pathlen)
-            relduration = duration * tottime / animation_time # unscaled time
-            if generate_js_svg:
-                js_anim_time.append(relduration)
-            newelapsedlen = elapsedlen + pathlen
-            newelapsedtime = elapsedtime + duration
-            anim_start = elapsedtime/tottime*100
-            anim_end = newelapsedtime/tottime*100
-
-            if generate_svg:
-                # animation stroke progression
-                animated_css += d("""
-                    @keyframes strike-%s {
-                        0%% { stroke-dashoffset: %.03f; }
-                        %.03f%% { stroke-dashoffset: %.03f; }
-                        %.03f%% { stroke-dashoffset: 0; }
-                        100%% { stroke-dashoffset: 0; }
-                    }""" % (pathname, pathlen, anim_start, pathlen, anim_end))
-
-                # animation visibility
-                animated_css += d("""
-                    @keyframes showhide-%s {
-                        %.03f%% { visibility: hidden; }
-                        %.03f%% { stroke: %s; }
-                    }""" % (pathname, anim_start, anim_end, STOKE_FILLING_COLOR))
-
-                # animation progression
-                animated_css += d("""
-                    #%s {
-                        stroke-dasharray: %.03f %.03f;
-                        stroke-dashoffset: 0;
-                        animation: strike-%s %.03fs %s infinite,
-                            showhide-%s %.03fs step-start infinite;
-                    }""" % (anim_pathidcss, pathlen, pathlen,
-                            pathname, animation_time,
-                            TIMING_FUNCTION,
-                            pathname, animation_time))
-
-                if SHOW_BRUSH:
-                    # brush element visibility
-                    animated_css += d("""
-                        @keyframes showhide-brush-%s {
-                            %.03f%% { visibility: hidden; }
-                            %.03f%% { visibility: visible; }
-                            100%% { visibility: hidden; }
-                        }""" % (pathname, anim_start, anim_end))
-
-                    # brush element progression
-                    animated_css += d("""
-                        #%s, #%s {
-                            stroke-dasharray: 0 %.03f;
-                            animation: strike-%s %.03fs %s infinite,
-                                showhide-brush-%s %.03fs step-start infinite;
-                        }""" % (brush_pathidcss, brush_brd_pathidcss,
-                            pathlen,
-                            pathname, animation_time, TIMING_FUNCTION,
-                            pathname, animation_time))
-
-            if generate_js_svg:
-                js_animated_css += d("""\n
-                    /* stroke %s */""" % pathid)
-
-                # brush and background hidden by default
-                if SHOW_BRUSH:
-                    js_animated_css += d("""
-                        #%s, #%s, #%s {
-                            visibility: hidden;
-                        }""") % (brush_pathidcss, brush_brd_pathidcss, bg_pathidcss)
-
-                # hide stroke after current element
-                after_curr = '[class *= "current"]'
-                js_animated_css += d("""
-                    %s ~ #%s {
-                        visibility: hidden;
-                    }""") % (after_curr, anim_pathidcss)
-
-                # and show bg after current element, or if animated
-                js_animated_css += d("""
-                    %s ~ #%s, #%s.animate {
-                        visibility: visible;
-                    }""") % (after_curr, bg_pathidcss, bg_pathidcss)
-
-                # animation stroke progression
-                js_animated_css += d("""
-                    @keyframes strike-%s {
-                        0%% { stroke-dashoffset: %.03f; }
-                        100%% { stroke-dashoffset: 0; }
-                    }""" % (pathname, pathlen))
-
-                js_animated_css += d("""
-                    #%s.animate {
-                        stroke: %s;
-                        stroke-dasharray: %.03f %.03f;
-                        visibility: visible;
-                        animation: strike-%s %.03fs %s forwards 1;
-                    }""" % (anim_pathidcss,
-                            STOKE_FILLING_COLOR,
-                            pathlen, pathlen,
-                            pathname, relduration, TIMING_FUNCTION))
-                if SHOW_BRUSH:
-                    js_animated_css += d("""
-                        @keyframes strike-brush-%s {
-                            0%% { stroke-dashoffset: %.03f; }
-                            100%% { stroke-dashoffset: 0.4; }
-                        }""" % (pathname, pathlen))
-                    js_animated_css += d("""
-                        #%s.animate.brush, #%s.animate.brush {
-                            stroke-dasharray: 0 %.03f;
-                            visibility: visible;
-                            animation: strike-brush-%s %.03fs %s forwards 1;
-                        }""") % (brush_pathidcss, brush_brd_pathidcss,
-                                pathlen,
-                                pathname, relduration, TIMING_FUNCTION)
-
-            if generate_gif:
-                for k in static_css:
-                    time = k * GIF_FRAME_DURATION
-                    reltime = time * tottime / animation_time # unscaled time
-
-                    static_css[k] += d("""
-                    /* stroke %s */
-                    """ % pathid)
-
-                    # animation
-                    if reltime < elapsedtime: #just hide everything
-                        rule = "#%s" % anim_pathidcss
-                        if SHOW_BRUSH:
-                            rule += ", #%s, #%s" % (brush_pathidcss, brush_brd_pathidcss)
-                        static_css[k] += d("""
-                            %s {
-                                visibility: hidden;
-                            }""" % rule)
-                    elif reltime > newelapsedtime: #just hide the brush, and bg
-                        rule = "#%s" % bg_pathidcss
-                        if SHOW_BRUSH:
-                            rule += ", #%s, #%s" % (brush_pathidcss, brush_brd_pathidcss)
-                        static_css[k] += d("""
-                            %s {
-                                visibility: hidden;
-                            }""" % (rule))
-                    else:
-                        intervalprop = ((reltime-elapsedtime) /
-                                    (newelapsedtime-elapsedtime))
-                        progression = my_timing_func(intervalprop)
-                        static_css[k] += d("""
-                            #%s {
-                                stroke-dasharray: %.03f %.03f;
-                                stroke-dashoffset: %.04f;
-                                stroke: %s;
-                            }""" % (anim_pathidcss, pathlen, pathlen+0.002,
-                                pathlen * (1-progression)+0.0015,
-                                STOKE_FILLING_COLOR))
-                        if SHOW_BRUSH:
-                            static_css[k] += d("""
-                                #%s, #%s {
-                                    stroke-dasharray: 0.001 %.03f;
-                                    stroke-dashoffset: %.04f;
-                                }""" % (brush_pathidcss, brush_brd_pathidcss,
-                                    pathlen+0.002,
-                                    pathlen * (1-progression)+0.0015))
-
-            elapsedlen = newelapsedlen
-            elapsedtime = newelapsedtime
-
+    for stroke in strokes:
+        pathidcss = re.sub(r':', '\\\\3a ', stroke.id)
+        newelapsedtime = elapsedtime + stroke.duration
+        stroke_values.append({
+            'pathid': stroke.id,
+            'pathname': re.sub(r'^kvg:','',stroke.id),
+            'anim': pathidcss+'-anim',
+            'bg': pathidcss+'-bg',
+            'brush': pathidcss+'-brush',
+            'brush_brd': pathidcss+'-brush-brd',
+            'pathlen': stroke.length,
+            'pathlen_gap': stroke.length+0.002,
+            'start': elapsedtime/tottime*100,
+            'end': newelapsedtime/tottime*100,
+            'animation_time': animation_time,
+            'relduration': stroke.duration * tottime / animation_time, # unscaled time
+            'timing': s.timing_function.css,
+            'filling_color': s.STOKE_FILLING_COLOR,
+        })
+        elapsedtime = newelapsedtime
+
+    # create references to the paths in each group
+    for strokenum, stroke in enumerate(strokes, 1):
+        for g, suffix, slot in [(bg_g, '-bg', 'stroke-%d'),
+                                (anim_g, '-anim', 'anim-%d')] + (
+                                [(brush_g, '-brush', 'stroke-%d'),
+                                 (brush_brd_g, '-brush-brd', 'stroke-%d')]
+                                if s.SHOW_BRUSH else []):
+            ref = E.use(id = stroke.id+suffix)
+            ref.set('{http://www.w3.org/1999/xlink}href','#'+stroke.id)
+            attribute_slot(ref, slot % strokenum)
+            g.append(ref)
 
     # insert groups
-    if SHOW_BRUSH and not SHOW_BRUSH_FRONT_BORDER:
+    if s.SHOW_BRUSH and not s.SHOW_BRUSH_FRONT_BORDER:
         doc.getroot().append(brush_brd_g)
     doc.getroot().append(bg_g)
-    if SHOW_BRUSH and SHOW_BRUSH_FRONT_BORDER:
+    if s.SHOW_BRUSH and s.SHOW_BRUSH_FRONT_BORDER:
         doc.getroot().append(brush_brd_g)
     doc.getroot().append(anim_g)
-    if SHOW_BRUSH:
+    if s.SHOW_BRUSH:
         doc.getroot().append(brush_g)
 
-    if generate_svg:
-        style = E.style(animated_css, id="style-Kanimaji")
-        doc.getroot().insert(0, style)
-        svgfile = filename_noext + '_anim.svg'
-        output_dir = os.path.join(OUTPUT_DIR, 'svg')
-        try:
-            os.makedirs(output_dir)
-        except OSError:
-            pass
-        output_path = os.path.join(output_dir, os.path.basename(svgfile))
-        doc.write(output_path, pretty_print=True)
-        doc.getroot().remove(style)
+    # serialize the document once, each output fills in the slots
+    style = E.style(id="style-Kanimaji")
+    text_slot(style, 'style')
+    doc.getroot().insert(0, style)
+    attribute_slot(doc.getroot(), 'root')
+    with timed(times, 'serialize'):
+        skeleton = DocumentSkeleton(doc, pretty_print=not minify)
+
+    results = {}
+    if 'svg' in outputs:
+        with timed(times, 'css'):
+            animated_css = ''.join(svg_css(baseid, groups, stroke_values,
+                                           animation_time, s, minify))
+        results['svg'] = skeleton.render({'style': escape_text(animated_css)})
+
+    if 'gif' in outputs:
+        with timed(times, 'css'):
+            gif_rules = list(gif_css_rules(groups, stroke_values, s))
+            last_frame_index = int(actual_animation_time/s.GIF_FRAME_DURATION)+1
+            last_frame_delay = animation_time - last_frame_index*s.GIF_FRAME_DURATION
+            documents = gif_frame_documents(
+                skeleton, gif_rules, strokes, tottime, animation_time,
+                last_frame_index, s)
+        delays = ([int(s.GIF_FRAME_DURATION*100)] * last_frame_index +
+                  [int(last_frame_delay*100)])
+        results['gif'] = (documents, delays)
+
+    if 'js_svg' in outputs:
+        with timed(times, 'css'):
+            js_animated_css = ''.join(js_svg_css(groups, stroke_values,
+                                                 animation_time, s, minify))
+        # data read by scripts, written the same whether minified or not
+        js_anim_time = [values['relduration'] for values in stroke_values]
+        patches = {
+            'style': escape_text(js_animated_css),
+            'root': format_attributes([('data-num-strokes',
+                                        str(len(js_anim_time)))]),
+            'first-stroke': '<a%s/>' % format_attributes([('data-stroke',
+                                                           '0')]),
+        }
+        for i in range(0, len(js_anim_time)):
+            patches['stroke-%d' % (i+1)] = format_attributes([
+                ('data-stroke', str(i+1))])
+            patches['anim-%d' % (i+1)] = format_attributes([
+                ('data-stroke', str(i+1)),
+                ('data-duration', str(js_anim_time[i]))])
+        results['js_svg'] = skeleton.render(patches)
+
+    return results
+
+
+def create_animation(
+    filename,
+    generate_svg=True,
+    generate_js_svg=False,
+    generate_gif=False,
+    rasterizer=None,
+    minify=False,
+    compress=(),
+    times=None,
+    sizes=None,
+    deferred=None,
+):
+    """
+    Writes the animations of the KanjiVG file filename. The seconds spent
+    in each stage are added to the times dict, and the size of each output
+    set in the sizes dict, if given. If deferred is a list, the steps
+    running external tools to make the GIF are added to it instead of being
+    run.
+    """
+    _sanity_check_gif(generate_gif)
+    s = default_settings()
+
+    filename_noext = re.sub(r'\.[^\.]+$','',filename)
+    filename_noext_ascii = re.sub(r'\\([\\u])','\\1',
+                            json.dumps(filename_noext))[1:-1]
+    baseid = basename(filename_noext_ascii)
+
+    # load xml, even with the strokes in the stroke index: the animations
+    # are added to the document itself
+    with timed(times, 'parse'):
+        doc = etree.parse(filename, parser)
+
+    outputs = [output_type for output_type, wanted in [
+        ('svg', generate_svg),
+        ('js_svg', generate_js_svg),
+        ('gif', generate_gif),
+    ] if wanted]
+    with timed(times, 'geometry'):
+        groups = indexed_stroke_groups(basename(filename))
+    results = build_animations(doc, baseid, s, outputs, minify,
+                               get_length_cache(), times, groups)
+    if groups is None and get_length_cache() is not None:
+        with timed(times, 'geometry'):
+            get_length_cache().flush()
+
+    for output_type in ['svg', 'js_svg']:
+        if output_type in results:
+            write_output(output_path(filename, output_type),
+                         results[output_type], compress, times)
+            if sizes is not None:
+                sizes[output_type] = len(results[output_type])
 
     if generate_gif:
-        svgframefiles = []
-        pngframefiles = []
-        svgexport_data = []
-        for k in static_css:
-            svgframefile = filename_noext_ascii + ("_frame%04d.svg"%k)
-            pngframefile = filename_noext_ascii + ("_frame%04d.png"%k)
-            svgframefiles.append(svgframefile)
-            pngframefiles.append(pngframefile)
-            svgexport_data.append({"input": [abspath(svgframefile)],
-                                   "output": [[abspath(pngframefile),
-                                                 "%d:%d"% (GIF_SIZE, GIF_SIZE)]]})
-
-            style = E.style(static_css[k], id="style-Kanimaji")
-            doc.getroot().insert(0, style)
-            output_dir = os.path.join(OUTPUT_DIR, 'gif')
-            try:
-                os.makedirs(output_dir)
-            except OSError:
-                pass
-            output_path = os.path.join(output_dir, os.path.basename(svgframefile))
-            doc.write(output_path, pretty_print=True)
-            doc.getroot().remove(style)
-
-        # create json file
-        svgexport_datafile = filename_noext_ascii+"_export_data.json"
-        with open(svgexport_datafile,'w') as f:
-            f.write(json.dumps(svgexport_data))
-        print 'created instructions %s' % svgexport_datafile
-
-        # run svgexport
-        cmdline = 'svgexport %s' % shescape(svgexport_datafile)
-        print cmdline
-        if os.system(cmdline) != 0:
-            exit('Error running external command')
-
-        if DELETE_TEMPORARY_FILES:
-            os.remove(svgexport_datafile)
-            for f in svgframefiles:
-                os.remove(f)
-
-        # generate GIF
-        giffile_tmp1 = filename_noext + '_anim_tmp1.gif'
-        giffile_tmp2 = filename_noext + '_anim_tmp2.gif'
-        giffile = filename_noext + '_anim.gif'
-        escpngframefiles = ' '.join(shescape(f) for f in pngframefiles[0:-1])
-
-        if GIF_BACKGROUND_COLOR == 'transparent':
-            bgopts = '-dispose previous'
-        else:
-            bgopts = "-background '%s' -alpha remove" % GIF_BACKGROUND_COLOR
-        cmdline = ("convert -delay %d %s -delay %d %s "+
-                    "%s -layers OptimizePlus %s") % (
-                    int(GIF_FRAME_DURATION*100),
-                    escpngframefiles,
-                    int(last_frame_delay*100),
-                    shescape(pngframefiles[-1]),
-                    bgopts,
-                    shescape(giffile_tmp1))
-        print cmdline
-        if os.system(cmdline) != 0:
-            exit('Error running external command')
-
-        if DELETE_TEMPORARY_FILES:
-            for f in pngframefiles:
-                os.remove(f)
-            print 'cleaned up.'
-
-        cmdline = ("convert %s \\( -clone 0--1 -background none "+
-                   "+append -quantize transparent -colors 63 "+
-                   "-unique-colors -write mpr:cmap +delete \\) "+
-                   "-map mpr:cmap %s") % (
-                    shescape(giffile_tmp1),
-                    shescape(giffile_tmp2))
-        print cmdline
-        if os.system(cmdline) != 0:
-            exit('Error running external command')
-        if DELETE_TEMPORARY_FILES:
-            os.remove(giffile_tmp1)
-
-        cmdline = ("gifsicle -O3 %s -o %s") % (
-                    shescape(giffile_tmp2),
-                    shescape(giffile))
-        print cmdline
-        if os.system(cmdline) != 0:
-            exit('Error running external command')
-        if DELETE_TEMPORARY_FILES:
-            os.remove(giffile_tmp2)
-
-    if generate_js_svg:
-        f0insert = [bg_g, anim_g]
-        if SHOW_BRUSH: f0insert += [brush_g, brush_brd_g]
-        for g in f0insert:
-            el = E.a()
-            el.set("data-stroke","0")
-            g.insert(0, el)
-
-        for i in range(0, len(js_anim_els)):
-            els = js_anim_els[i]
-            for k in els:
-                els[k].set("data-stroke",str(i+1))
-            els["anim"].set("data-duration", str(js_anim_time[i]))
-
-        doc.getroot().set('data-num-strokes', str(len(js_anim_els)))
-
-        style = E.style(js_animated_css, id="style-Kanimaji")
-        doc.getroot().insert(0, style)
-        svgfile = filename_noext + '_js_anim.svg'
-        output_dir = os.path.join(OUTPUT_DIR, 'js_svg')
+        documents, delays = results['gif']
+        gif_dir = os.path.join(OUTPUT_DIR, 'gif')
         try:
-            os.makedirs(output_dir)
+            os.makedirs(gif_dir)
         except OSError:
             pass
-        output_path = os.path.join(output_dir, os.path.basename(svgfile))
-        doc.write(output_path, pretty_print=True)
-        doc.getroot().remove(style)
+        prefix = os.path.join(gif_dir, basename(filename_noext_ascii))
+        if rasterizer is None:
+            rasterizer = get_rasterizer(
+                s.GIF_RASTERIZER,
+                delete_temporary_files=s.DELETE_TEMPORARY_FILES)
+        with timed(times, 'rasterize'):
+            frames, steps = rasterizer.prepare(documents, s.GIF_SIZE, prefix)
+            if s.GIF_ENCODER != 'native':
+                frames = frame_files(frames, prefix)
+        giffile = output_path(filename, 'gif')
+        steps += gif_steps(frames, prefix, giffile, delays, s)
+        if deferred is not None and any(is_external(step) for step in steps):
+            # left to a ToolScheduler, along with those of other files
+            deferred.extend(steps)
+        else:
+            run_steps(steps, times)
+            if sizes is not None and os.path.exists(giffile):
+                sizes['gif'] = os.path.getsize(giffile)
+
+
+def _encode_gif(frames, giffile, delays, background, palette_frames):
+    optional_module('gif_encoder').write_gif(
+        giffile, frame_images(frames), delays, background, palette_frames)
+
+
+def gif_steps(frames, prefix, giffile, delays, s):
+    """
+    The tools.Steps assembling and optimizing giffile from its frames (PNG
+    files with ImageMagick), with GIF_ENCODER.
+    """
+    delete = s.DELETE_TEMPORARY_FILES
+    if s.GIF_ENCODER == 'native':
+        if optional_module('gif_encoder') is None:
+            raise RuntimeError('The native GIF encoder needs NumPy and Pillow')
+        # frames rendered in memory may only be made while encoding
+        files = [f for f in frames if isinstance(f, basestring)
+                 ] if isinstance(frames, list) else []
+        return [Step('encode', _encode_gif,
+                     (frames, giffile, delays, s.GIF_BACKGROUND_COLOR,
+                      s.GIF_PALETTE_FRAMES),
+                     files if delete else [])]
+
+    giffile_tmp1 = prefix + '_anim_tmp1.gif'
+    giffile_tmp2 = prefix + '_anim_tmp2.gif'
+    if s.GIF_BACKGROUND_COLOR == 'transparent':
+        bgopts = ['-dispose', 'previous']
+    else:
+        bgopts = ['-background', s.GIF_BACKGROUND_COLOR, '-alpha', 'remove']
+    convert = ['convert']
+    if s.GIF_TOOL_MEMORY_LIMIT is not None:
+        # the pixel cache goes to disk beyond it, memory mapped or not
+        convert += ['-limit', 'memory', s.GIF_TOOL_MEMORY_LIMIT,
+                    '-limit', 'map', s.GIF_TOOL_MEMORY_LIMIT]
+    return [
+        # assemble the frames
+        tool_step('convert',
+                  convert + ['-delay', str(delays[0])] + frames[:-1] +
+                  ['-delay', str(delays[-1]), frames[-1]] + bgopts +
+                  ['-layers', 'OptimizePlus', giffile_tmp1],
+                  frames if delete else []),
+        # with a palette shared by all the frames
+        tool_step('convert',
+                  convert + [giffile_tmp1, '(', '-clone', '0--1',
+                   '-background', 'none', '+append', '-quantize',
+                   'transparent', '-colors', '63', '-unique-colors',
+                   '-write', 'mpr:cmap', '+delete', ')', '-map', 'mpr:cmap',
+                   giffile_tmp2],
+                  [giffile_tmp1] if delete else []),
+        tool_step('gifsicle', ['gifsicle', '-O3', giffile_tmp2, '-o', giffile],
+                  [giffile_tmp2] if delete else []),
+    ]
+
+
+# the group of the strokes, its id ending with the name of the file
+_STROKE_PATHS_ID_RE = re.compile(r'^kvg:StrokePaths_(.+)$')
+
+
+def render(svg, outputs=('svg',), settings=None, name=None, rasterizer=None,
+           minify=False):
+    """
+    Renders the animations of a KanjiVG SVG in memory, for using kanimaji
+    as a library, eg. to render them on demand:
+
+        data = render(svg, ['js_svg'], Settings(SHOW_BRUSH=False))['js_svg']
+
+    svg is the SVG data, or an lxml tree (which is copied, not modified),
+    and name the base of the ids of the added elements, by default the name
+    of the kanji as in its KanjiVG file name. Returns a dict of the data of
+    each of the outputs ('svg', 'js_svg' or 'gif').
+
+    Nothing is written to disk nor printed, and errors are raised, so it
+    can be called from several threads. Rendering GIFs needs a rasterizer
+    working in memory (GIF_RASTERIZER = 'cairosvg'), and they are always
+    assembled by the native encoder.
+    """
+    s = settings or default_settings()
+    if isinstance(svg, basestring):
+        # a parser per call, they can't be shared between threads
+        doc = etree.fromstring(
+            svg, etree.XMLParser(remove_blank_text=True)).getroottree()
+    else:
+        if not isinstance(svg, etree._ElementTree):
+            svg = svg.getroottree()
+        # with the comments around the root element
+        doc = deepcopy(svg)
+    if name is None:
+        for g in _top_groups(doc):
+            m = _STROKE_PATHS_ID_RE.match(g.get('id', ''))
+            if m:
+                name = m.group(1)
+                break
+        else:
+            raise ValueError('no kvg:StrokePaths_ group to name the '
+                             'animation after, pass name')
+
+    if 'gif' in outputs:
+        gif_encoder = optional_module('gif_encoder')
+        if gif_encoder is None:
+            raise RuntimeError('The native GIF encoder needs NumPy and Pillow')
+        if rasterizer is None:
+            rasterizer = get_rasterizer(s.GIF_RASTERIZER)
+        if not rasterizer.in_memory:
+            raise ValueError('rendering GIFs in memory needs a rasterizer '
+                             'that works in memory, like cairosvg')
+
+    results = build_animations(doc, name, s, outputs, minify)
+    if 'gif' in results:
+        documents, delays = results['gif']
+        frames = rasterizer.render(documents, s.GIF_SIZE, None)
+        gif = BytesIO()
+        gif_encoder.write_gif(gif, frame_images(frames), delays,
+                              s.GIF_BACKGROUND_COLOR, s.GIF_PALETTE_FRAMES)
+        results['gif'] = gif.getvalue()
+    return results
+
+
+def manifest_path():
+    return os.path.join(OUTPUT_DIR, 'manifest.json')
 
 
 def clear_converted():
-    for ext in ['svg', 'gif']:
-        for converted_file in glob.glob(os.path.join(OUTPUT_DIR, '*.' + ext)):
+    for subdir, suffix in OUTPUT_TYPES.values():
+        for converted_file in glob.glob(
+                os.path.join(OUTPUT_DIR, subdir, '*' + suffix + '*')):
             os.remove(converted_file)
+        for shared in glob.glob(
+                os.path.join(OUTPUT_DIR, subdir, SHARED_CSS_FILE + '*')):
+            os.remove(shared)
+    if os.path.exists(manifest_path()):
+        os.remove(manifest_path())
+
+
+def _init_worker():
+    # let the parent process handle ^C and terminate the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _create_animation_worker(args):
+    svg_path, options, profile = args
+    deferred = []
+    cache = get_length_cache()
+    if cache is not None:
+        hits, misses = cache.hits, cache.misses
+    if profile:
+        times, sizes = {}, {}
+        start = timeit.default_timer()
+    else:
+        # nothing is measured
+        times = sizes = None
+    try:
+        create_animation(svg_path, times=times, sizes=sizes,
+                         deferred=deferred, **options)
+        error = None
+    except (Exception, SystemExit) as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    if cache is not None:
+        # report this file's share, counters live in the worker process
+        cache_stats = (cache.hits - hits, cache.misses - misses)
+    else:
+        cache_stats = (0, 0)
+    if profile:
+        profile = {'file': basename(svg_path),
+                   'seconds': timeit.default_timer() - start,
+                   'stages': times, 'sizes': sizes}
+    else:
+        profile = None
+    return svg_path, error, cache_stats, profile, deferred
+
+
+PROFILED_STAGES = ['parse', 'geometry', 'css', 'serialize', 'write',
+                   'compress', 'rasterize', 'encode', 'convert', 'gifsicle']
+
+
+def _print_profile(profiles, slowest=10):
+    """The time spent in each stage, output sizes and the slowest files."""
+    times = {}
+    sizes = {}
+    for profile in profiles:
+        for stage, seconds in profile['stages'].items():
+            times[stage] = times.get(stage, 0) + seconds
+        for output_type, size in profile['sizes'].items():
+            sizes.setdefault(output_type, []).append(size)
+
+    total = sum(times.values()) or 1
+    print 'time spent, summed over all workers:'
+    for stage in PROFILED_STAGES:
+        if stage in times:
+            print '  %-10s %9.3fs %5.1f%%' % (stage, times[stage],
+                                             100 * times[stage] / total)
+    if sizes:
+        print 'output sizes:'
+        for output_type in sorted(sizes):
+            print '  %-10s %6d files %9.1f KB, %7.1f KB max' % (
+                output_type, len(sizes[output_type]),
+                sum(sizes[output_type]) / 1024.0,
+                max(sizes[output_type]) / 1024.0)
+    if slowest:
+        print 'slowest files:'
+        for profile in sorted(profiles, key=lambda p: -p['seconds'])[:slowest]:
+            stages = sorted(profile['stages'].items(), key=lambda i: -i[1])
+            print '  %-20s %7.3fs  %s' % (
+                profile['file'], profile['seconds'], ', '.join(
+                    '%s %.3fs' % (stage, seconds)
+                    for stage, seconds in stages[:3]))
+
+
+def _write_profile_json(profiles, path):
+    """The profile of each file, as a JSON object per line."""
+    with open(path, 'w') as f:
+        for profile in profiles:
+            f.write(json.dumps(profile, sort_keys=True) + '\n')
+
+
+def _index_worker(svg_path):
+    try:
+        doc = etree.parse(svg_path, strokes_parser)
+        groups = load_stroke_groups(doc, default_settings(),
+                                    get_length_cache())
+        if get_length_cache() is not None:
+            get_length_cache().flush()
+    except Exception:
+        # not indexed, the generators will report the error
+        return svg_path, None
+    return svg_path, [(g.id, [(stroke.id, stroke.d, stroke.length,
+                               stroke.duration) for stroke in g.strokes])
+                      for g in groups]
+
+
+def update_stroke_index(svg_paths, source_hashes, jobs=1):
+    """
+    Brings the stroke index up to date with the KanjiVG files svg_paths,
+    whose content hashes are in source_hashes by name, measuring those
+    that are new or changed, and loads it for the generators.
+    """
+    global _stroke_index
+    from tqdm import tqdm
+    index = optional_module('stroke_index').StrokeIndex(
+        STROKE_INDEX_FILE, stroke_index_key(default_settings()))
+    changed = False
+    for name in index.names():
+        if name not in source_hashes:
+            index.remove(name)
+            changed = True
+    todo = [svg_path for svg_path in svg_paths
+            if not index.is_up_to_date(basename(svg_path),
+                                       source_hashes[basename(svg_path)])]
+    if todo:
+        print 'indexing the strokes of %d file(s)' % len(todo)
+        if jobs > 1:
+            pool = Pool(jobs, _init_worker)
+            results = pool.imap_unordered(_index_worker, todo, 16)
+        else:
+            pool = None
+            results = (_index_worker(svg_path) for svg_path in todo)
+        try:
+            for svg_path, groups in tqdm(results, total=len(todo),
+                                         mininterval=0.5, miniters=5):
+                if groups is not None:
+                    index.put(basename(svg_path),
+                              source_hashes[basename(svg_path)], groups)
+                    changed = True
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    if changed:
+        index.save()
+    _stroke_index = index
+
+
+def _timeline_worker(svg_path):
+    try:
+        s = default_settings()
+        return svg_path, timeline_record(file_stroke_groups(svg_path, s),
+                                         s), None
+    except Exception as e:
+        return svg_path, None, '%s: %s' % (type(e).__name__, e)
+
+
+def create_timeline(svg_paths, pool=None):
+    """
+    Packs the stroke timelines of the KanjiVG files svg_paths in the
+    timeline file, returning the files that failed (and then nothing is
+    written) with their errors.
+    """
+    import timeline
+    from tqdm import tqdm
+    s = default_settings()
+    if pool is not None:
+        results = pool.imap_unordered(_timeline_worker, svg_paths, 16)
+    else:
+        results = (_timeline_worker(svg_path) for svg_path in svg_paths)
+    records = {}
+    failures = []
+    for svg_path, record, error in tqdm(results, total=len(svg_paths),
+                                        mininterval=0.5, miniters=5):
+        if error is not None:
+            failures.append((svg_path, error))
+        else:
+            records[re.sub(r'\.[^\.]+$', '', basename(svg_path))] = record
+    if failures:
+        return failures
+
+    path = output_path(TIMELINE_FILE, 'timeline')
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        pass
+    timeline.write_timelines(path, records, s.timing_function.css,
+                             s.TIMELINE_POLYLINES)
+    return []
 
 
 def create_animations(
     generate_svg=True,
     generate_js_svg=False,
     generate_gif=False,
+    generate_timeline=False,
+    use_index=False,
+    jobs=1,
+    profile=False,
+    minify=False,
+    compress=(),
+    profile_json=None,
+    slowest=10,
 ):
-    for svg_path in tqdm(
-        glob.glob(os.path.join(KANJIVG_SVG_DIR, '*.svg')),
-        mininterval=0.5, miniters=5
-    ):
-        create_animation(
-            svg_path,
-            generate_svg=generate_svg,
-            generate_js_svg=generate_js_svg,
-            generate_gif=generate_gif,
-        )
+    from tqdm import tqdm
+    try:
+        default_settings()
+    except ValueError as e:
+        exit('Sorry, %s' % e)
+    _sanity_check_gif(generate_gif)
+    if 'brotli' in compress and optional_module('brotli') is None:
+        exit('Writing .br files needs the brotli module')
+    if use_index and optional_module('stroke_index') is None:
+        exit('The stroke index needs NumPy')
+
+    requested = [output_type for output_type, wanted in [
+        ('svg', generate_svg),
+        ('js_svg', generate_js_svg),
+        ('gif', generate_gif),
+    ] if wanted]
+    build_info = dict((output_type, (settings_hash(output_type, minify),
+                                     GENERATOR_VERSIONS[output_type]))
+                      for output_type in requested)
+
+    try:
+        os.makedirs(OUTPUT_DIR)
+    except OSError:
+        pass
+    if SHARED_CSS:
+        for output_type in requested:
+            if output_type != 'gif':
+                write_shared_css(output_type, minify, compress)
+    manifest = BuildManifest(manifest_path())
+    svg_paths = sorted(glob.glob(os.path.join(KANJIVG_SVG_DIR, '*.svg')))
+
+    # delete what was generated from sources that disappeared
+    sources = set(basename(svg_path) for svg_path in svg_paths)
+    sources.add(CORPUS_SOURCE)
+    for source in list(manifest.sources):
+        if source not in sources:
+            for orphan in manifest.forget(source):
+                if os.path.exists(orphan):
+                    os.remove(orphan)
+
+    # only regenerate the outputs that are out of date
+    work = []
+    pending = {}
+    source_hashes = {}
+    corpus_hash = hashlib.sha1()
+    for svg_path in svg_paths:
+        source = basename(svg_path)
+        source_hash = source_hashes[source] = file_hash(svg_path)
+        corpus_hash.update('%s %s\n' % (source, source_hash))
+        stale = []
+        for output_type in requested:
+            digest, version = build_info[output_type]
+            if not manifest.is_up_to_date(source, source_hash, output_type,
+                                          digest, version):
+                stale.append(output_type)
+        if not stale:
+            continue
+        pending[svg_path] = (source, source_hash, stale)
+        work.append((svg_path, dict(
+            generate_svg='svg' in stale,
+            generate_js_svg='js_svg' in stale,
+            generate_gif='gif' in stale,
+            minify=minify,
+            compress=compress,
+        ), bool(profile or profile_json)))
+    if len(work) < len(svg_paths):
+        print '%d file(s) up to date' % (len(svg_paths) - len(work))
+    # the timeline is rebuilt whenever any of the files changed
+    corpus_hash = corpus_hash.hexdigest()
+    timeline_info = (settings_hash('timeline'),
+                     GENERATOR_VERSIONS['timeline'])
+    if generate_timeline and manifest.is_up_to_date(
+            CORPUS_SOURCE, corpus_hash, 'timeline', *timeline_info):
+        print 'stroke timeline up to date'
+        generate_timeline = False
+
+    if use_index:
+        # before the workers are started, so that they share it
+        update_stroke_index(svg_paths, source_hashes, jobs)
+
+    if jobs > 1:
+        # a few chunks per worker keeps them all busy until the end,
+        # while still amortizing the IPC overhead over many files
+        chunksize = max(1, len(work) // (jobs * 4))
+        pool = Pool(jobs, _init_worker)
+        results = pool.imap_unordered(_create_animation_worker, work,
+                                      chunksize)
+    else:
+        pool = None
+        results = (_create_animation_worker(w) for w in work)
+
+    def record(svg_path, output_types):
+        source, source_hash, stale = pending[svg_path]
+        for output_type in output_types:
+            digest, version = build_info[output_type]
+            manifest.record(source, source_hash, output_type, digest,
+                            version, output_files(svg_path, output_type,
+                                                  compress))
+
+    # the external tools making the GIFs run in stages, while the workers
+    # go on with the next files
+    scheduler = ToolScheduler(
+        dict((stage, n or cpu_count()) for stage, n in GIF_TOOL_JOBS.items()),
+        pool.apply if pool is not None else None,
+        {'rasterize': GIF_SVGEXPORT_BATCH})
+    failures = []
+    cache_hits = cache_misses = 0
+    profiles = {}
+    try:
+        for svg_path, error, (hits, misses), file_profile, deferred in tqdm(
+            results, total=len(work),
+            mininterval=0.5, miniters=5
+        ):
+            if error is not None:
+                failures.append((svg_path, error))
+            elif deferred:
+                # the GIF is recorded once made
+                record(svg_path, [output_type for output_type in
+                                  pending[svg_path][2] if output_type != 'gif'])
+                scheduler.submit(svg_path, deferred)
+            else:
+                record(svg_path, pending[svg_path][2])
+            cache_hits += hits
+            cache_misses += misses
+            if file_profile is not None:
+                profiles[svg_path] = file_profile
+
+        for svg_path, (error, times) in scheduler.join().items():
+            if error is not None:
+                failures.append((svg_path, error))
+            else:
+                record(svg_path, ['gif'])
+            file_profile = profiles.get(svg_path)
+            if file_profile is not None:
+                for stage, seconds in times.items():
+                    file_profile['stages'][stage] = (
+                        file_profile['stages'].get(stage, 0) + seconds)
+                    file_profile['seconds'] += seconds
+                giffile = output_path(svg_path, 'gif')
+                if error is None and os.path.exists(giffile):
+                    file_profile['sizes']['gif'] = os.path.getsize(giffile)
+
+        if generate_timeline:
+            timeline_failures = create_timeline(svg_paths, pool)
+            if timeline_failures:
+                failures.extend(timeline_failures)
+            else:
+                manifest.record(CORPUS_SOURCE, corpus_hash, 'timeline',
+                                timeline_info[0], timeline_info[1],
+                                [output_path(TIMELINE_FILE, 'timeline')])
+        if pool is not None:
+            pool.close()
+    except KeyboardInterrupt:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+        manifest.save()
+
+    if get_length_cache() is not None:
+        print 'length cache: %d hits, %d misses' % (cache_hits, cache_misses)
+    profiles = [profiles[svg_path] for svg_path in sorted(profiles)]
+    if profile:
+        _print_profile(profiles, slowest)
+    if profile_json:
+        _write_profile_json(profiles, profile_json)
+    for svg_path, error in sorted(failures):
+        print 'FAILED %s: %s' % (svg_path, error)
+    return failures
 
 
 def _parse_arguments():
@@ -589,15 +1644,64 @@ def _parse_arguments():
                         action='store_true', default=False)
     parser.add_argument('--gif', dest='generate_gif',
                         action='store_true', default=False)
+    parser.add_argument('--timeline', dest='generate_timeline',
+                        action='store_true', default=False,
+                        help='pack the stroke timelines of all the kanji '
+                             'in a single binary file')
+    parser.add_argument('--index', dest='use_index',
+                        action='store_true', default=False,
+                        help='measure the strokes of all the files once, '
+                             'in the STROKE_INDEX_FILE of settings.py, and '
+                             'generate from it')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='number of worker processes, 0 for one per CPU')
+    parser.add_argument('--force', dest='force',
+                        action='store_true', default=False,
+                        help='regenerate all files, even if up to date')
+    parser.add_argument('--minify', dest='minify',
+                        action='store_true', default=False,
+                        help='write the SVGs without indentation and '
+                             'with compact CSS')
+    parser.add_argument('--gzip', dest='compress', action='append_const',
+                        const='gzip', default=[],
+                        help='also write a gzip compressed .gz of each SVG')
+    parser.add_argument('--brotli', dest='compress', action='append_const',
+                        const='brotli',
+                        help='also write a brotli compressed .br of each SVG')
+    parser.add_argument('--profile', dest='profile',
+                        action='store_true', default=False,
+                        help='report the time spent in each stage, the '
+                             'output sizes and the slowest files')
+    parser.add_argument('--slowest', dest='slowest', type=int, default=10,
+                        help='number of slowest files reported by --profile')
+    parser.add_argument('--profile-json', dest='profile_json',
+                        metavar='FILE',
+                        help='write the time spent in each stage and output '
+                             'sizes of every file as JSON lines to FILE')
     return parser.parse_args()
 
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['serve']:
+        import server
+        server.main(sys.argv[2:])
+        sys.exit()
     options = _parse_arguments()
 
-    clear_converted()
-    create_animations(
+    if options.force:
+        clear_converted()
+    failures = create_animations(
         generate_svg=options.generate_svg,
         generate_js_svg=options.generate_js_svg,
         generate_gif=options.generate_gif,
+        generate_timeline=options.generate_timeline,
+        use_index=options.use_index,
+        jobs=options.jobs or cpu_count(),
+        profile=options.profile,
+        minify=options.minify,
+        compress=tuple(options.compress),
+        profile_json=options.profile_json,
+        slowest=options.slowest,
     )
+    if failures:
+        exit('%d file(s) failed to convert' % len(failures))
@@ -0,0 +1,98 @@
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+
+_METADATA_RE = re.compile(r'^svg\.path-([^-]+?)(-py[\d.]+)?\.(dist|egg)-info$')
+
+
+def svg_path_version():
+    # from the name of the metadata installed next to svg.path, importing
+    # pkg_resources would take longer than most runs of a worker
+    import svg.path
+    site = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(svg.path.__file__))))
+    for metadata in glob.glob(os.path.join(site, 'svg.path-*')):
+        m = _METADATA_RE.match(os.path.basename(metadata))
+        if m:
+            return m.group(1)
+
+    import pkg_resources
+    try:
+        return pkg_resources.get_distribution('svg.path').version
+    except pkg_resources.DistributionNotFound:
+        return 'unknown'
+
+
+class LengthCache(object):
+    """
+    Persistent cache of stroke lengths, keyed by a hash of the path data
+    and of the error tolerance used to measure it.
+
+    All entries are dropped when the cache was filled by a different
+    version of the length computation (eg. after upgrading svg.path).
+    Each process opens its own connection, so that an instance created
+    before forking the worker pool can be used in the workers.
+    """
+
+    def __init__(self, filename, version):
+        self.filename = filename
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        self._pending = []
+
+    @staticmethod
+    def key(d, error):
+        return hashlib.sha1('%s\0%r' % (d, error)).hexdigest()
+
+    def _connect(self):
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        self._pid = os.getpid()
+        self._pending = []
+        self._conn = conn = sqlite3.connect(self.filename, timeout=60)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS meta '
+                         '(name TEXT PRIMARY KEY, value TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS lengths '
+                         '(key TEXT PRIMARY KEY, length REAL)')
+            row = conn.execute("SELECT value FROM meta "
+                               "WHERE name = 'version'").fetchone()
+            if row is None or row[0] != self.version:
+                conn.execute('DELETE FROM lengths')
+                conn.execute("INSERT OR REPLACE INTO meta "
+                             "VALUES ('version', ?)", (self.version,))
+        return conn
+
+    def get(self, d, error):
+        row = self._connect().execute(
+            'SELECT length FROM lengths WHERE key = ?',
+            (self.key(d, error),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, d, error, length):
+        self._connect()
+        self._pending.append((self.key(d, error), length))
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO lengths VALUES (?, ?)',
+                             self._pending)
+        self._pending = []
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM lengths')
+        self._pending = []
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+
+
+def file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class BuildManifest(object):
+    """
+    Records, for each source file, the hash of its content and, for each
+    output type generated from it, the hash of the content, settings and
+    version of the generator it was made from, and which files were
+    written.
+
+    An output is up to date when all of these still match and its files
+    still exist. The outputs of an older content are kept until they are
+    made again, so that their files are still known when the source is
+    deleted.
+    """
+
+    FORMAT = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.sources = {}
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+        if data.get('format') == self.FORMAT:
+            self.sources = data['sources']
+
+    def is_up_to_date(self, source, source_hash, output_type,
+                      settings_hash, version):
+        entry = self.sources.get(source)
+        if entry is None:
+            return False
+        output = entry['outputs'].get(output_type)
+        return (output is not None and
+                output.get('source', entry['hash']) == source_hash and
+                output['settings'] == settings_hash and
+                output['version'] == version and
+                all(os.path.exists(f) for f in output['files']))
+
+    def record(self, source, source_hash, output_type,
+               settings_hash, version, files):
+        entry = self.sources.setdefault(source, {'outputs': {}})
+        for output in entry['outputs'].values():
+            # from before the source hash was recorded per output
+            output.setdefault('source', entry['hash'])
+        entry['hash'] = source_hash
+        entry['outputs'][output_type] = {
+            'source': source_hash,
+            'settings': settings_hash,
+            'version': version,
+            'files': files,
+        }
+
+    def forget(self, source):
+        """Drops a source, returning the files that were generated from it."""
+        entry = self.sources.pop(source, {'outputs': {}})
+        return [f for output in entry['outputs'].values()
+                for f in output['files']]
+
+    def save(self):
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'format': self.FORMAT, 'sources': self.sources}, f,
+                      indent=1, separators=(',', ': '), sort_keys=True)
+        os.rename(tmp, self.filename)
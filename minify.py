@@ -0,0 +1,87 @@
+"""
+Minification of the generated style sheets, for --minify.
+
+Comments and whitespace are removed, and numbers are only written with the
+precision they need: 3 decimals for durations (ie. milliseconds), 2 for
+lengths (a hundredth of a unit is a fraction of a pixel at usual sizes),
+and for the percentages of the keyframes as many as needed for a
+millisecond of the whole animation.
+
+The CSS templates are minified once, their number placeholders becoming
+string ones, filled with the numbers shortened by minify_values().
+"""
+
+import math
+import re
+
+_NUMBER_RE = re.compile(r'(?<![\w.\\-])(\d*\.\d+)(%|s\b|px\b)?')
+_NUMBER_PLACEHOLDER_RE = re.compile(r'%\((\w+)\)\.\d+f')
+
+# decimals of numbers, by unit
+DECIMALS = {'s': 3, 'px': 2, '': 2, '%': 3}
+
+
+def short_number(value, decimals):
+    """value with at most decimals decimals, without useless zeros."""
+    text = ('%.*f' % (decimals, value)).rstrip('0').rstrip('.')
+    if text.startswith('0.'):
+        text = text[1:]
+    return text or '0'
+
+
+def percent_decimals(animation_time):
+    """Decimals of a percentage of animation_time precise to 1ms."""
+    return max(1, int(math.ceil(math.log10(max(animation_time, 0.1) * 10))))
+
+
+def minify_css(css, decimals=DECIMALS):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    # the space ending an escape like \3a is significant, it is kept as it
+    # is never next to these
+    css = re.sub(r' ?([{};:,>~]|\*?=|!important) ?', r'\1', css)
+    css = css.replace(';}', '}')
+
+    def shorten(m):
+        unit = m.group(2) or ''
+        return short_number(float(m.group(1)), decimals[unit]) + unit
+    return _NUMBER_RE.sub(shorten, css).strip()
+
+
+def minify_template(template):
+    """
+    The %-template of CSS minified, its number placeholders becoming
+    string placeholders.
+    """
+    return minify_css(_NUMBER_PLACEHOLDER_RE.sub(r'%(\1)s', template))
+
+
+def minify_values(values, decimals):
+    """
+    The values to fill a minified template with, the numbers shortened to
+    decimals[name] decimals, or 2 by default.
+    """
+    return dict((name, short_number(value, decimals.get(name, 2))
+                 if isinstance(value, float) else value)
+                for name, value in values.items())
+
+
+if __name__ == '__main__':
+    # a quick check on a typical style sheet
+    from textwrap import dedent as d
+    print minify_css(d("""
+        /* CSS automatically generated by kanimaji.py, do not edit! */
+        #kvg\\3a 00058-s1-anim {
+            stroke-dasharray: 97.765 97.765;
+            stroke-dashoffset: 0;
+            animation: strike-00058-s1 4.396s ease-in-out infinite,
+                showhide-00058-s1 4.396s step-start infinite;
+        }
+        @keyframes strike-00058-s1 {
+            0% { stroke-dashoffset: 97.765; }
+            0.000% { stroke-dashoffset: 97.765; }
+            33.037% { stroke-dashoffset: 0.400; }
+        }
+        [class *= "current"] ~ #kvg\\3a 00058-s1-bg {
+            stroke-width: 4.5px !important;
+        }"""))
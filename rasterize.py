@@ -0,0 +1,183 @@
+"""
+Rasterization of the GIF frames, from SVG documents to square bitmaps.
+
+A rasterizer renders all the frames of a kanji, returning one frame per
+document: either the name of a PNG file or a PIL image, which ever the
+backend produces natively. Frames rendered in memory are only rendered as
+they are iterated over, once. frame_files() and frame_images() convert
+them for the tools assembling the GIF, one at a time.
+"""
+
+import json
+import os
+import re
+import tempfile
+from io import BytesIO
+from os.path import abspath
+
+from tools import (
+    Step,
+    batchable,
+    external,
+    run_steps,
+    run_tool,
+)
+
+
+class Rasterizer(object):
+
+    # whether frames are rendered without temporary files
+    in_memory = False
+
+    def render(self, documents, size, prefix):
+        """
+        Renders the serialized SVG documents as size x size frames.
+        Temporary files, if any, are named starting with prefix.
+        """
+        frames, steps = self.prepare(documents, size, prefix)
+        run_steps(steps)
+        return frames
+
+    def prepare(self, documents, size, prefix):
+        """
+        Like render(), but returns the tools.Steps left to run to produce
+        the frames along with them, so that they can be scheduled with
+        those of other kanji. Rasterizers define either method.
+        """
+        return self.render(documents, size, prefix), []
+
+
+class SvgexportRasterizer(Rasterizer):
+    """
+    Runs the svgexport Node.js tool (ie. headless Chrome) on frames written
+    to disk, once per kanji.
+    """
+
+    def __init__(self, delete_temporary_files=False):
+        self.delete_temporary_files = delete_temporary_files
+
+    def prepare(self, documents, size, prefix):
+        svgframefiles = []
+        pngframefiles = []
+        svgexport_data = []
+        for k, document in enumerate(documents):
+            svgframefile = prefix + ("_frame%04d.svg"%k)
+            pngframefile = prefix + ("_frame%04d.png"%k)
+            svgframefiles.append(svgframefile)
+            pngframefiles.append(pngframefile)
+            svgexport_data.append({"input": [abspath(svgframefile)],
+                                   "output": [[abspath(pngframefile),
+                                                 "%d:%d"% (size, size)]]})
+            with open(svgframefile, 'wb') as f:
+                f.write(document)
+
+        # create json file
+        svgexport_datafile = prefix+"_export_data.json"
+        with open(svgexport_datafile,'w') as f:
+            f.write(json.dumps(svgexport_data))
+
+        return pngframefiles, [Step(
+            'rasterize', run_svgexport, ([svgexport_datafile],),
+            [svgexport_datafile] + svgframefiles
+            if self.delete_temporary_files else [])]
+
+
+@external
+@batchable
+def run_svgexport(datafiles):
+    """
+    Runs svgexport on the frames of all the datafiles at once, so that it
+    starts its browser only once.
+    """
+    if len(datafiles) == 1:
+        return run_tool(['svgexport', datafiles[0]])
+    jobs = []
+    for datafile in datafiles:
+        with open(datafile) as f:
+            jobs.extend(json.load(f))
+    fd, batchfile = tempfile.mkstemp(
+        suffix='_export_data.json', dir=os.path.dirname(abspath(datafiles[0])))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(jobs))
+        run_tool(['svgexport', batchfile])
+    finally:
+        os.remove(batchfile)
+
+
+_ROOT_TAG_RE = re.compile(r'<svg\b[^>]*>')
+_SIZE_ATTRIBUTE_RE = re.compile(r'\s(?:width|height)="[^"]*"')
+
+
+def sized(document, size):
+    """
+    The document with its root element size x size pixels, its viewBox
+    being scaled to fit.
+    """
+    m = _ROOT_TAG_RE.search(document)
+    tag = _SIZE_ATTRIBUTE_RE.sub('', m.group(0))
+    return (document[:m.start()] +
+            '<svg width="%d" height="%d"' % (size, size) + tag[len('<svg'):] +
+            document[m.end():])
+
+
+class CairoSvgRasterizer(Rasterizer):
+    """
+    Renders the frames in process with cairosvg, without touching disk.
+    cairosvg 1.x (the last supporting Python 2) renders PNGs at the size of
+    the document, whatever the dpi, so that is set in the document itself.
+    """
+
+    in_memory = True
+
+    def __init__(self, delete_temporary_files=False):
+        import cairosvg
+        self.svg2png = cairosvg.svg2png
+
+    def render(self, documents, size, prefix):
+        return self._frames(documents, size)
+
+    def _frames(self, documents, size):
+        from PIL import Image
+        for document in documents:
+            png = self.svg2png(bytestring=sized(document, size))
+            frame = Image.open(BytesIO(png))
+            frame.load()
+            yield frame
+
+
+RASTERIZERS = {
+    'svgexport': SvgexportRasterizer,
+    'cairosvg': CairoSvgRasterizer,
+}
+
+
+def get_rasterizer(name, **options):
+    if name not in RASTERIZERS:
+        raise ValueError('unknown rasterizer "%s", choose one of %s' % (
+            name, ', '.join(sorted(RASTERIZERS))))
+    return RASTERIZERS[name](**options)
+
+
+def frame_files(frames, prefix):
+    """The frames as PNG files, saving those that are images."""
+    files = []
+    for k, frame in enumerate(frames):
+        if not isinstance(frame, basestring):
+            filename = prefix + ("_frame%04d.png"%k)
+            frame.save(filename)
+            frame = filename
+        files.append(frame)
+    return files
+
+
+def frame_images(frames):
+    """
+    The frames as RGBA images, loading those that are files, one at a time
+    as they are iterated over.
+    """
+    from PIL import Image
+    for frame in frames:
+        if isinstance(frame, basestring):
+            frame = Image.open(frame)
+        yield frame.convert('RGBA')
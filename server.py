@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+An HTTP server rendering the animations on demand, run it with
+
+    ./kanimaji.py serve [--port PORT] [--jobs N] [--cache-size MB]
+
+It answers GET /svg/<kanji>, /js-svg/<kanji> and /gif/<kanji>, where
+<kanji> is the character itself or its code point in hex (eg. 6c34),
+optionally followed by a KanjiVG variant (eg. 04e14-Kaisho), rendered from
+the files in KANJIVG_SVG_DIR with the settings of settings.py. With
+SHARED_CSS, /svg/kanimaji.css and /js-svg/kanimaji.css are the style sheets
+the SVGs import (which browsers don't load for an <img>).
+
+Rendering runs in a pool of processes, the results are kept in a cache of
+the least recently used ones, bounded in bytes, and concurrent requests for
+the same animation all wait for a single rendering. Responses carry an
+ETag, so clients can revalidate their copy for free.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import threading
+import urllib
+from BaseHTTPServer import (
+    BaseHTTPRequestHandler,
+    HTTPServer,
+)
+from SocketServer import ThreadingMixIn
+from collections import OrderedDict
+from multiprocessing import (
+    Pool,
+    cpu_count,
+)
+
+import kanimaji
+from rasterize import get_rasterizer
+from settings import *
+
+# route: (output type, content type)
+ROUTES = {
+    'svg': ('svg', 'image/svg+xml'),
+    'js-svg': ('js_svg', 'image/svg+xml'),
+    'gif': ('gif', 'image/gif'),
+}
+
+_KANJI_RE = re.compile(r'^([0-9a-fA-F]{2,6})(-[A-Za-z0-9]+)?$')
+
+
+def kanjivg_name(kanji):
+    """
+    The name of the KanjiVG file (without extension) of a kanji as written
+    in a URL, or None if it isn't one.
+    """
+    try:
+        kanji = urllib.unquote(kanji).decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+    if len(kanji) == 1:
+        return '%05x' % ord(kanji)
+    m = _KANJI_RE.match(kanji)
+    if m is None:
+        return None
+    return '%05x%s' % (int(m.group(1), 16), m.group(2) or '')
+
+
+class LRUCache(object):
+    """
+    A mapping keeping at most max_bytes of values, the least recently used
+    ones being dropped first.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return None
+            self._items[key] = item
+            return item[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                key, (value, size) = self._items.popitem(last=False)
+                self.size -= size
+
+    def __len__(self):
+        return len(self._items)
+
+
+def _render_file(args):
+    path, output_type, minify = args
+    try:
+        with open(path, 'rb') as f:
+            svg = f.read()
+        return kanimaji.render(svg, [output_type], minify=minify)[output_type]
+    except Exception as e:
+        # not every exception can be sent back from the worker
+        raise RuntimeError('%s: %s' % (type(e).__name__, e))
+
+
+class _Rendering(object):
+    """A rendering in progress, that other requests can wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RenderService(object):
+    """
+    Renders the animations of the files of svg_dir in the process pool,
+    caching them in the LRUCache cache, and coalescing the renderings of
+    the same animation requested concurrently.
+    """
+
+    def __init__(self, svg_dir, pool, cache, minify=False):
+        self.svg_dir = svg_dir
+        self.pool = pool
+        self.cache = cache
+        self.minify = minify
+        self.stylesheets = {}
+        if SHARED_CSS:
+            for output_type in ['svg', 'js_svg']:
+                self.stylesheets[output_type] = self._stylesheet(output_type)
+        self.renders = 0
+        self.coalesced = 0
+        self._rendering = {}
+        self._lock = threading.Lock()
+
+    def _stylesheet(self, output_type):
+        css = kanimaji.shared_css(output_type, kanimaji.default_settings())
+        if self.minify:
+            css = kanimaji.minify_css(css)
+        return css, '"%s"' % hashlib.sha1(css).hexdigest()
+
+    def source(self, name):
+        """The KanjiVG file of name, or None if there is none."""
+        path = os.path.join(self.svg_dir, name + '.svg')
+        return path if os.path.exists(path) else None
+
+    def get(self, output_type, name):
+        """The data of the animation, and its ETag."""
+        key = (output_type, name)
+        with self._lock:
+            result = self.cache.get(key)
+            if result is not None:
+                return result
+            rendering = self._rendering.get(key)
+            if rendering is None:
+                rendering = self._rendering[key] = _Rendering()
+                self.renders += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if leader:
+            try:
+                data = self.pool.apply(_render_file, [(
+                    os.path.join(self.svg_dir, name + '.svg'), output_type,
+                    self.minify)])
+                rendering.result = (data, '"%s"' % hashlib.sha1(
+                    data).hexdigest())
+                self.cache.put(key, rendering.result, len(data))
+            except Exception as e:
+                rendering.error = e
+            finally:
+                with self._lock:
+                    del self._rendering[key]
+                rendering.done.set()
+        else:
+            rendering.done.wait()
+        if rendering.error is not None:
+            raise rendering.error
+        return rendering.result
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body):
+        service = self.server.service
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) != 2 or parts[0] not in ROUTES:
+            return self.send_error(404)
+        output_type, content_type = ROUTES[parts[0]]
+        if output_type not in self.server.output_types:
+            return self.send_error(501, 'GIFs need an in memory rasterizer, '
+                                        'set GIF_RASTERIZER = \'cairosvg\'')
+        if (parts[1] == kanimaji.SHARED_CSS_FILE and
+                output_type in service.stylesheets):
+            # imported by the SVGs relatively to their own URL
+            data, etag = service.stylesheets[output_type]
+            content_type = 'text/css'
+        else:
+            name = kanjivg_name(parts[1])
+            if name is None or service.source(name) is None:
+                return self.send_error(404)
+            try:
+                data, etag = service.get(output_type, name)
+            except Exception as e:
+                return self.send_error(500, str(e))
+
+        if etag in [tag.strip() for tag in
+                    self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+
+class RenderServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, output_types):
+        HTTPServer.__init__(self, address, RenderRequestHandler)
+        self.service = service
+        self.output_types = output_types
+
+
+def _available_output_types():
+    try:
+        gif = get_rasterizer(GIF_RASTERIZER).in_memory
+    except ImportError:
+        gif = False
+    return set(['svg', 'js_svg'] + (['gif'] if gif else []))
+
+
+def serve(host='127.0.0.1', port=8000, jobs=1, cache_size=64, minify=False):
+    """Serves until interrupted, with a cache of cache_size MB."""
+    kanimaji.default_settings()  # fail early if they are invalid
+    pool = Pool(jobs, kanimaji._init_worker)
+    service = RenderService(KANJIVG_SVG_DIR, pool,
+                            LRUCache(cache_size * 1024 * 1024), minify)
+    server = RenderServer((host, port), service, _available_output_types())
+    print 'serving %s on http://%s:%d/' % (KANJIVG_SVG_DIR, host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.terminate()
+        pool.join()
+
+
+def _parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog='kanimaji.py serve')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='number of rendering processes, 0 for one per '
+                             'CPU')
+    parser.add_argument('--cache-size', type=int, default=64,
+                        help='MB of rendered animations kept in memory')
+    parser.add_argument('--minify', action='store_true', default=False,
+                        help='serve SVGs without indentation and with '
+                             'compact CSS')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = _parse_arguments(argv)
+    serve(options.host, options.port, options.jobs or cpu_count(),
+          options.cache_size, options.minify)
+
+
+if __name__ == '__main__':
+    main()
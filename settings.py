@@ -3,6 +3,22 @@ import math
 KANJIVG_SVG_DIR = './kanjivg/kanji/'
 OUTPUT_DIR = './converted/'
 
+# stroke lengths are cached across runs in this sqlite file,
+# set to None to always compute them.
+LENGTH_CACHE_FILE = './.kanimaji_cache.sqlite'
+
+# with --index, the stroke groups of all the files and the lengths and
+# durations of their strokes are kept in this file, so that generating
+# the animations again (eg. with other colors) skips measuring them.
+STROKE_INDEX_FILE = './.kanimaji_index.npz'
+
+# stroke lengths are measured with Gauss-Legendre quadrature ('quadrature',
+# needs NumPy) or with the generic svg.path implementation ('svg.path').
+# Lengths are printed with 3 decimals, the tolerance only needs to be well
+# below that.
+PATH_LENGTH_ENGINE    = 'quadrature'
+PATH_LENGTH_TOLERANCE = 1e-6
+
 # *_BORDER_WIDTH is the width INCLUDING the border.
 STOKE_BORDER_WIDTH   = 4.5
 STOKE_BORDER_COLOR   = "#666"
@@ -22,6 +38,12 @@ BRUSH_BORDER_WIDTH      = 7
 
 WAIT_AFTER = 1.5
 
+# set to true to write the CSS rules common to all kanji once, in a
+# kanimaji.css file next to the SVGs and JS-SVGs which they import, making
+# them smaller. Browsers only load it for SVGs opened as documents (eg.
+# with <object>), not as <img>.
+SHARED_CSS = False
+
 # gif settings
 DELETE_TEMPORARY_FILES = False
 GIF_SIZE               = 150
@@ -29,6 +51,37 @@ GIF_FRAME_DURATION     = 0.04
 GIF_BACKGROUND_COLOR   = '#ddf'
 # set to true to allow transparent background, much bigger file!
 GIF_ALLOW_TRANSPARENT  = False
+# how frames are rasterized: 'svgexport' runs the svgexport Node.js tool,
+# 'cairosvg' renders them in process with the cairosvg library.
+GIF_RASTERIZER         = 'svgexport'
+# how frames are assembled into the GIF: 'imagemagick' runs ImageMagick and
+# gifsicle, 'native' encodes them in process (needs NumPy and Pillow).
+GIF_ENCODER            = 'imagemagick'
+# how many of the external tools run at once in each stage of making the
+# GIFs of a batch, 0 for one per CPU: svgexport rasterizing frames (each
+# starts a headless browser), convert and gifsicle.
+GIF_TOOL_JOBS          = {'rasterize': 2, 'convert': 0, 'gifsicle': 0,
+                          'encode': 0}
+# how many kanji svgexport rasterizes per run in a batch, so that its
+# browser starts once for all of them rather than once per kanji.
+GIF_SVGEXPORT_BATCH    = 200
+# the native encoder makes the palette from this many frames at most, spread
+# over the animation, keeping the frames of longer ones in a temporary file
+# meanwhile rather than in memory.
+GIF_PALETTE_FRAMES     = 256
+# with ImageMagick, eg. '256MiB' to have convert keep its frames on disk
+# beyond that much memory, rather than all of them in memory; None for no
+# limit.
+GIF_TOOL_MEMORY_LIMIT  = None
+# the stroke timeline file (--timeline) also has the strokes flattened to
+# polylines, curves being cut in pieces about TIMELINE_POLYLINE_STEP long
+# (the kanji are 109 wide).
+TIMELINE_POLYLINES     = False
+TIMELINE_POLYLINE_STEP = 2.0
+# 0 to compute the timing function exactly at each frame, else the number
+# of samples of the table it is interpolated from (faster, within ~2e-6 of
+# the keyword curves with 1024 samples, less for steep cubic-bezier()s).
+GIF_TIMING_SAMPLES     = 0
 
 # sqrt, ie a stroke 4 times the length is drawn
 # at twice the speed, in twice the time.
@@ -40,7 +93,8 @@ def stroke_length_to_duration(length):
 def time_rescale(interval):
     return math.pow(2 * interval, 2.0/3)
 
-# Possibilities are linear, ease, ease-in, ease-in-out, ease-out, see
+# Possibilities are linear, ease, ease-in, ease-in-out, ease-out, step-start,
+# step-end, cubic-bezier(x1, y1, x2, y2) and steps(n[, position]), see
 #   https://developer.mozilla.org/en-US/docs/Web/CSS/timing-function
 # for more info.
 TIMING_FUNCTION = "ease-in-out"
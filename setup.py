@@ -11,13 +11,32 @@ setup(
     license='MIT',
     scripts=[
         'kanimaji.py',
+        'arclength.py',
         'bezier_cubic.py',
+        'gif_encoder.py',
+        'gif_frames.py',
+        'length_cache.py',
+        'manifest.py',
+        'minify.py',
+        'rasterize.py',
+        'server.py',
         'settings.py',
+        'skeleton.py',
+        'stroke_index.py',
+        'timeline.py',
+        'timing.py',
+        'tools.py',
     ],
     install_requires=[
         'svg.path',
         'tqdm',
         'lxml',
     ],
+    extras_require={
+        'fast': ['numpy'],
+        'cairosvg': ['cairosvg>=1.0,<2', 'Pillow'],
+        'gif': ['numpy', 'Pillow'],
+        'brotli': ['brotli'],
+    },
     zip_safe=False,
 )
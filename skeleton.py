@@ -0,0 +1,106 @@
+"""
+A document serialized once, with named slots where each output splices in
+its own content, instead of modifying and re-serializing the tree per
+output.
+
+Slots are marked in the tree before serializing it:
+ * text_slot() is replaced by the (escaped) text of an element, e.g. the
+   contents of the style sheet;
+ * attribute_slot() by extra attributes, after those the element has;
+ * line_slot() by an extra child element, on its own line if pretty
+   printed, or nothing.
+
+The skeleton is immutable, so the outputs can be rendered in any order or
+concurrently.
+"""
+
+import re
+from xml.sax.saxutils import escape
+
+from lxml import etree
+
+_MARKER = 'kanimaji-slot'
+_SLOTS_RE = re.compile(
+    r'%(m)s:text:([\w-]+):|'
+    r' %(m)s="([\w-]+)"|'
+    r'<!--%(m)s:line:([\w-]+)-->' % {'m': _MARKER})
+
+TEXT = 'text'
+ATTRIBUTE = 'attribute'
+LINE = 'line'
+
+
+def text_slot(element, name):
+    element.text = '%s:text:%s:' % (_MARKER, name)
+
+
+def attribute_slot(element, name):
+    element.set(_MARKER, name)
+
+
+def line_slot(parent, index, name):
+    parent.insert(index, etree.Comment('%s:line:%s' % (_MARKER, name)))
+
+
+def escape_text(text):
+    # as lxml does when serializing text
+    return escape(text).encode('ascii', 'xmlcharrefreplace')
+
+
+def format_attributes(attributes):
+    """Serializes the (name, value) pairs, to fill an attribute slot."""
+    return ''.join(' %s="%s"' % (name, escape(value, {
+        '"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#9;'}))
+        for name, value in attributes).encode('ascii', 'xmlcharrefreplace')
+
+
+class DocumentSkeleton(object):
+
+    def __init__(self, doc, pretty_print=True):
+        serialized = etree.tostring(doc, pretty_print=pretty_print)
+        chunks = []
+        slots = []
+        start = 0
+        for m in _SLOTS_RE.finditer(serialized):
+            end = m.start()
+            if m.group(1) is not None:
+                slots.append((TEXT, m.group(1), None))
+            elif m.group(2) is not None:
+                slots.append((ATTRIBUTE, m.group(2), None))
+            else:
+                # the line it is on, when pretty printed, goes with it
+                line = serialized.rfind('\n', start, end)
+                if line >= 0 and not serialized[line+1:end].strip(' '):
+                    end = line
+                slots.append((LINE, m.group(3), serialized[end:m.start()]))
+            chunks.append(serialized[start:end])
+            start = m.end()
+        chunks.append(serialized[start:])
+        self.chunks = tuple(chunks)
+        self.slots = tuple(slots)
+
+    def _pieces(self, patches):
+        yield self.chunks[0]
+        for (kind, name, indent), chunk in zip(self.slots, self.chunks[1:]):
+            patch = patches.get(name)
+            if patch:
+                if kind == LINE:
+                    yield indent
+                yield patch
+            yield chunk
+
+    def render(self, patches):
+        """
+        The serialized document, with the slots filled from the patches
+        dict, by name. Missing slots are left empty.
+        """
+        return ''.join(self._pieces(patches))
+
+    def around(self, name, patches):
+        """
+        The document split at the slot name, ie. what comes before and
+        after it, with the other slots filled from patches.
+        """
+        head, tail = self.render(dict(
+            patches, **{name: _MARKER})).split(_MARKER)
+        return head, tail
@@ -0,0 +1,167 @@
+"""
+The stroke groups of all the KanjiVG files, with the lengths and durations
+of their strokes, measured once and stored in columns: NumPy arrays of the
+values of all the strokes of the corpus one after the other, and tables of
+offsets telling which strokes are in which group and which groups in which
+file. Generating the animations from it needs no geometry at all.
+
+The index is saved as an .npz file, strings as the bytes of all of them
+joined together and the offsets where each one starts. It is only valid
+for the key it was built with (how the lengths were measured and turned
+into durations), and the entry of a file for the hash of its content.
+"""
+
+import os
+import zipfile
+
+import numpy
+
+FORMAT = 1
+
+
+def _pack_strings(strings):
+    strings = [string.encode('utf-8') for string in strings]
+    offsets = numpy.zeros(len(strings) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(string) for string in strings], out=offsets[1:])
+    return numpy.frombuffer(''.join(strings) or '\0', numpy.uint8), offsets
+
+
+def _text(data):
+    # as lxml returns them, str if ASCII else unicode
+    try:
+        data.decode('ascii')
+        return data
+    except UnicodeDecodeError:
+        return data.decode('utf-8')
+
+
+def _unpack_strings(data, offsets):
+    data = data.tostring()
+    offsets = offsets.tolist()
+    return [_text(data[start:end])
+            for start, end in zip(offsets, offsets[1:])]
+
+
+def _offsets(counts):
+    offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+class StrokeIndex(object):
+    """
+    For each file name, the hash of its content and its stroke groups, as
+    a list of (group id, [(stroke id, path data, length, duration), ...]).
+    """
+
+    def __init__(self, filename, key):
+        self.filename = filename
+        self.key = key
+        self._hashes = {}
+        self._rows = {}
+        self._columns = None
+        try:
+            self._load()
+        except (IOError, ValueError, KeyError, zipfile.BadZipfile):
+            # missing, built with another key or unreadable, start over
+            self._hashes = {}
+            self._rows = {}
+
+    def _load(self):
+        with numpy.load(self.filename) as data:
+            if (int(data['format']) != FORMAT or
+                    data['key'].tostring() != self.key):
+                return
+            names = _unpack_strings(data['names'], data['name_offsets'])
+            hashes = _unpack_strings(data['hashes'], data['hash_offsets'])
+            group_ids = _unpack_strings(data['group_ids'],
+                                        data['group_id_offsets'])
+            stroke_ids = _unpack_strings(data['stroke_ids'],
+                                         data['stroke_id_offsets'])
+            stroke_ds = _unpack_strings(data['stroke_ds'],
+                                        data['stroke_d_offsets'])
+            file_groups = data['file_groups'].tolist()
+            group_strokes = data['group_strokes'].tolist()
+            lengths = data['lengths'].tolist()
+            durations = data['durations'].tolist()
+        self._hashes = dict(zip(names, hashes))
+        # rows are only assembled when asked for
+        self._rows = dict(
+            (name, (file_groups[i], file_groups[i + 1]))
+            for i, name in enumerate(names))
+        self._columns = (group_ids, group_strokes, stroke_ids, stroke_ds,
+                         lengths, durations)
+
+    def _row(self, name):
+        row = self._rows[name]
+        if isinstance(row, list):
+            return row
+        (group_ids, group_strokes, stroke_ids, stroke_ds, lengths,
+         durations) = self._columns
+        groups = []
+        for g in range(*row):
+            strokes = range(group_strokes[g], group_strokes[g + 1])
+            groups.append((group_ids[g], [
+                (stroke_ids[i], stroke_ds[i], lengths[i], durations[i])
+                for i in strokes]))
+        return groups
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def names(self):
+        return self._rows.keys()
+
+    def is_up_to_date(self, name, source_hash):
+        return self._hashes.get(name) == source_hash
+
+    def get(self, name):
+        """The stroke groups of name, or None if it isn't indexed."""
+        if name not in self._rows:
+            return None
+        return self._row(name)
+
+    def put(self, name, source_hash, groups):
+        self._hashes[name] = source_hash
+        self._rows[name] = list(groups)
+
+    def remove(self, name):
+        self._hashes.pop(name, None)
+        self._rows.pop(name, None)
+
+    def save(self):
+        names = sorted(self._rows)
+        rows = [self._row(name) for name in names]
+        groups = [group for row in rows for group in row]
+        strokes = [stroke for group_id, group in groups for stroke in group]
+        columns = {
+            'format': numpy.array(FORMAT),
+            'key': numpy.frombuffer(self.key, numpy.uint8),
+            'file_groups': _offsets([len(row) for row in rows]),
+            'group_strokes': _offsets([len(group) for group_id, group
+                                       in groups]),
+            'lengths': numpy.array([stroke[2] for stroke in strokes],
+                                   dtype=numpy.float64),
+            'durations': numpy.array([stroke[3] for stroke in strokes],
+                                     dtype=numpy.float64),
+        }
+        for column, offsets, strings in [
+            ('names', 'name_offsets', names),
+            ('hashes', 'hash_offsets', [self._hashes[name]
+                                        for name in names]),
+            ('group_ids', 'group_id_offsets', [group_id for group_id, group
+                                               in groups]),
+            ('stroke_ids', 'stroke_id_offsets', [stroke[0]
+                                                 for stroke in strokes]),
+            ('stroke_ds', 'stroke_d_offsets', [stroke[1]
+                                               for stroke in strokes]),
+        ]:
+            columns[column], columns[offsets] = _pack_strings(strings)
+
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            numpy.savez(f, **columns)
+        os.rename(tmp, self.filename)
@@ -0,0 +1,93 @@
+"""
+Lengths measured by arclength against svg.path, over the KanjiVG sample of
+bench/kanji and paths using the commands it doesn't.
+
+    python -m unittest discover
+"""
+
+import glob
+import os
+import re
+import unittest
+
+from svg.path import parse_path
+
+import arclength
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'bench', 'kanji')
+
+TOLERANCE = 1e-6
+# svg.path is itself only accurate to a few 1e-6
+MAX_DIFFERENCE = 1e-5
+
+EXTRA_PATHS = [
+    # relative lines and curves
+    'm10,10 l20,5 c5,10 15,10 20,0 z',
+    # smooth curves, absolute and relative, after a curve and not
+    'M10,10 C20,20 40,20 50,10 S80,0 90,10',
+    'M10,10 c10,10 30,10 40,0 s30,-10 40,0 s10,20 -5,15',
+    'M10,10 S30,40 50,10',
+    # horizontal and vertical lines
+    'M10,10 H50 V40 H10 Z',
+    'M10,10 h40 v30 h-40 v-30',
+    'M10,10 h40 c5,0 10,5 10,10 V60 s-10,10 -20,10',
+    # a cusp
+    'M10,10 C60,60 0,60 50,10',
+]
+
+# arcs and quadratic curves are left to the fallback
+FALLBACK_PATHS = [
+    'M10,10 A20,20 0 0,1 50,10',
+    'M10,10 Q30,40 50,10 T90,10',
+]
+
+
+def corpus_paths():
+    paths = []
+    for filename in sorted(glob.glob(os.path.join(CORPUS_DIR, '*.svg'))):
+        with open(filename) as f:
+            paths.extend(re.findall(r'\sd="([^"]*)"', f.read()))
+    return paths
+
+
+def reference_length(d):
+    return parse_path(d).length(error=1e-8)
+
+
+class PathLengthsTest(unittest.TestCase):
+
+    def assertLengths(self, paths, found):
+        self.assertEqual(len(found), len(paths))
+        for d, length in zip(paths, found):
+            self.assertAlmostEqual(length, reference_length(d),
+                                   delta=MAX_DIFFERENCE, msg=d)
+
+    def test_corpus(self):
+        paths = corpus_paths()
+        self.assertTrue(paths)
+        self.assertLengths(paths, arclength.path_lengths(paths, TOLERANCE))
+
+    def test_commands(self):
+        self.assertLengths(EXTRA_PATHS,
+                           arclength.path_lengths(EXTRA_PATHS, TOLERANCE))
+
+    def test_fallback(self):
+        paths = EXTRA_PATHS[:2] + FALLBACK_PATHS
+        measured = []
+
+        def fallback(d):
+            measured.append(d)
+            return reference_length(d)
+        self.assertLengths(paths, arclength.path_lengths(paths, TOLERANCE,
+                                                         fallback))
+        self.assertEqual(measured, FALLBACK_PATHS)
+
+    def test_unsupported_without_fallback(self):
+        for d in FALLBACK_PATHS:
+            self.assertRaises(arclength.UnsupportedPath,
+                              arclength.path_lengths, [d], TOLERANCE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+Incremental builds: which outputs the BuildManifest finds up to date, and
+the files of deleted sources being cleaned up.
+
+    python -m unittest discover
+"""
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import kanimaji
+from manifest import BuildManifest
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'bench', 'kanji')
+
+
+class BuildManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'manifest.json')
+        self.files = {}
+        for output_type in ['svg', 'gif']:
+            path = os.path.join(self.tmpdir, output_type)
+            open(path, 'w').close()
+            self.files[output_type] = [path]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_up_to_date(self):
+        manifest = BuildManifest(self.filename)
+        manifest.record('a', 'h1', 'svg', 's1', 1, self.files['svg'])
+        manifest.save()
+        manifest = BuildManifest(self.filename)
+        self.assertTrue(manifest.is_up_to_date('a', 'h1', 'svg', 's1', 1))
+        self.assertFalse(manifest.is_up_to_date('a', 'h2', 'svg', 's1', 1))
+        self.assertFalse(manifest.is_up_to_date('a', 'h1', 'svg', 's2', 1))
+        self.assertFalse(manifest.is_up_to_date('a', 'h1', 'svg', 's1', 2))
+        self.assertFalse(manifest.is_up_to_date('a', 'h1', 'gif', 's1', 1))
+        os.remove(self.files['svg'][0])
+        self.assertFalse(manifest.is_up_to_date('a', 'h1', 'svg', 's1', 1))
+
+    def test_stale_outputs_are_kept(self):
+        manifest = BuildManifest(self.filename)
+        manifest.record('a', 'h1', 'svg', 's', 1, self.files['svg'])
+        manifest.record('a', 'h1', 'gif', 's', 1, self.files['gif'])
+        # the source changed, only the SVG is made again
+        manifest.record('a', 'h2', 'svg', 's', 1, self.files['svg'])
+        self.assertTrue(manifest.is_up_to_date('a', 'h2', 'svg', 's', 1))
+        self.assertFalse(manifest.is_up_to_date('a', 'h2', 'gif', 's', 1))
+        self.assertEqual(sorted(manifest.forget('a')),
+                         sorted(self.files['svg'] + self.files['gif']))
+
+
+class IncrementalBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.svg_dir = os.path.join(self.tmpdir, 'kanji')
+        os.mkdir(self.svg_dir)
+        for name in ['04e00.svg', '04e8c.svg']:
+            shutil.copy(os.path.join(CORPUS_DIR, name), self.svg_dir)
+        self.saved = dict((name, getattr(kanimaji, name)) for name in
+                          ['KANJIVG_SVG_DIR', 'OUTPUT_DIR',
+                           'LENGTH_CACHE_FILE', '_length_cache'])
+        kanimaji.KANJIVG_SVG_DIR = self.svg_dir
+        kanimaji.OUTPUT_DIR = os.path.join(self.tmpdir, 'converted')
+        kanimaji.LENGTH_CACHE_FILE = None
+        kanimaji._length_cache = None
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(kanimaji, name, value)
+        shutil.rmtree(self.tmpdir)
+
+    def build(self, **outputs):
+        failures = kanimaji.create_animations(compress=('gzip',), **outputs)
+        self.assertEqual(failures, [])
+
+    def outputs(self, name):
+        return sorted(os.path.basename(f) for f in glob.glob(
+            os.path.join(kanimaji.OUTPUT_DIR, '*', name + '*')))
+
+    def test_deleted_source(self):
+        self.build(generate_svg=True, generate_js_svg=True)
+        self.assertEqual(self.outputs('04e8c'), [
+            '04e8c_anim.svg', '04e8c_anim.svg.gz',
+            '04e8c_js_anim.svg', '04e8c_js_anim.svg.gz'])
+
+        # edit the source, then only make the SVGs again
+        source = os.path.join(self.svg_dir, '04e8c.svg')
+        with open(source, 'a') as f:
+            f.write('\n')
+        self.build(generate_svg=True)
+        self.assertEqual(len(self.outputs('04e8c')), 4)
+
+        os.remove(source)
+        self.build(generate_svg=True)
+        self.assertEqual(self.outputs('04e8c'), [])
+        self.assertEqual(self.outputs('04e00'), [
+            '04e00_anim.svg', '04e00_anim.svg.gz',
+            '04e00_js_anim.svg', '04e00_js_anim.svg.gz'])
+
+
+if __name__ == '__main__':
+    unittest.main()
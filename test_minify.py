@@ -0,0 +1,145 @@
+"""
+--minify: the shortened numbers, and minified animations keeping the same
+keyframes as the full ones.
+
+    python -m unittest discover
+"""
+
+import os
+import re
+import unittest
+
+from lxml import etree
+
+import kanimaji
+from minify import (
+    minify_css,
+    minify_template,
+    percent_decimals,
+    short_number,
+)
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'bench', 'kanji')
+
+_KEYFRAMES_RE = re.compile(
+    r'@keyframes\s+([\w-]+)\s*\{((?:[^{}]*\{[^{}]*\})*)\s*\}')
+_RULE_RE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+_NUMBER_RE = re.compile(r'^(-?\d*\.?\d+)(%|s|px)?$')
+
+
+def _value(text):
+    m = _NUMBER_RE.match(text)
+    if m is None:
+        return text
+    return float(m.group(1)), m.group(2)
+
+
+def keyframes(data):
+    """The keyframes of the style of an SVG: name: [(stops, decls)]."""
+    style = etree.fromstring(data).find('{http://www.w3.org/2000/svg}style')
+    result = {}
+    for name, body in _KEYFRAMES_RE.findall(style.text):
+        frames = []
+        for selector, declarations in _RULE_RE.findall(body):
+            stops = [_value(stop.strip())
+                     for stop in selector.split(',')]
+            decls = []
+            for declaration in declarations.split(';'):
+                if declaration.strip():
+                    prop, value = declaration.split(':', 1)
+                    decls.append((prop.strip(), [
+                        _value(v) for v in value.split()]))
+            frames.append((stops, decls))
+        result[name] = frames
+    return result
+
+
+class ShortNumberTest(unittest.TestCase):
+
+    def test_short_number(self):
+        for value, decimals, text in [(0.768, 3, '.768'), (1.5, 3, '1.5'),
+                                      (2.0, 2, '2'), (0.0001, 3, '0'),
+                                      (12.3456, 2, '12.35'),
+                                      (0.100, 3, '.1')]:
+            self.assertEqual(short_number(value, decimals), text)
+
+    def test_percent_decimals(self):
+        # a millisecond of the whole animation
+        self.assertEqual(percent_decimals(0.5), 1)
+        self.assertEqual(percent_decimals(5), 2)
+        self.assertEqual(percent_decimals(50), 3)
+
+    def test_minify_css(self):
+        self.assertEqual(minify_css(
+            '/* comment */\n#kvg\\3a 04e00-s1-anim {\n'
+            '    stroke-dashoffset: 0.400;\n    --len: 12.000;\n}\n'),
+            '#kvg\\3a 04e00-s1-anim{stroke-dashoffset:.4;--len:12}')
+
+    def test_minify_template(self):
+        template = minify_template(
+            '#%(anim)s {\n    --len: %(pathlen).03f;\n}')
+        self.assertEqual(template, '#%(anim)s{--len:%(pathlen)s}')
+        self.assertEqual(template % {'anim': 'a', 'pathlen': '1.5'},
+                         '#a{--len:1.5}')
+
+
+class MinifiedOutputTest(unittest.TestCase):
+
+    def assertSameKeyframes(self, full, minified):
+        self.assertEqual(sorted(full), sorted(minified))
+        for name in full:
+            self.assertEqual(len(full[name]), len(minified[name]), name)
+            for (stops, decls), (mstops, mdecls) in zip(full[name],
+                                                        minified[name]):
+                self.assertValues(stops, mstops, name)
+                self.assertEqual([p for p, v in decls],
+                                 [p for p, v in mdecls], name)
+                for (p, values), (mp, mvalues) in zip(decls, mdecls):
+                    self.assertValues(values, mvalues, name)
+
+    def assertValues(self, values, minified, name):
+        self.assertEqual(len(values), len(minified), name)
+        for value, mvalue in zip(values, minified):
+            if isinstance(value, tuple):
+                # keyframes are precise to a millisecond
+                self.assertAlmostEqual(value[0], mvalue[0], delta=0.05,
+                                       msg=name)
+                self.assertEqual(value[1], mvalue[1], name)
+            else:
+                self.assertEqual(value, mvalue, name)
+
+    def render(self, name, output_type, **settings):
+        with open(os.path.join(CORPUS_DIR, name)) as f:
+            svg = f.read()
+        s = kanimaji.Settings(**settings)
+        return (kanimaji.render(svg, [output_type], s)[output_type],
+                kanimaji.render(svg, [output_type], s,
+                                minify=True)[output_type])
+
+    def test_keyframes(self):
+        for name in sorted(os.listdir(CORPUS_DIR)):
+            for output_type in ['svg', 'js_svg']:
+                for shared in [False, True]:
+                    full, minified = self.render(name, output_type,
+                                                 SHARED_CSS=shared)
+                    self.assertTrue(len(minified) < len(full))
+                    full_keyframes = keyframes(full)
+                    # the JS-SVG ones are all in the shared style sheet
+                    self.assertEqual(bool(full_keyframes),
+                                     output_type == 'svg' or not shared)
+                    self.assertSameKeyframes(full_keyframes,
+                                             keyframes(minified))
+
+    def test_data_duration(self):
+        full, minified = self.render('04e8c.svg', 'js_svg')
+        durations = re.findall(r'data-duration="([^"]*)"', full)
+        self.assertTrue(durations)
+        self.assertEqual(re.findall(r'data-duration="([^"]*)"', minified),
+                         durations)
+        for duration in durations:
+            self.assertTrue(duration.startswith('0.'), duration)
+
+
+if __name__ == '__main__':
+    unittest.main()
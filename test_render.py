@@ -0,0 +1,75 @@
+"""
+Rendering KanjiVG documents in memory with kanimaji.render(), including
+documents that already have styles or animations of their own.
+
+    python -m unittest discover
+"""
+
+import os
+import unittest
+
+from lxml import etree
+
+import kanimaji
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'bench', 'kanji', '04e8c.svg')
+
+OUTPUTS = ['svg', 'js_svg']
+
+
+def read_sample():
+    with open(SAMPLE, 'rb') as f:
+        return f.read()
+
+
+def top_styles(data):
+    root = etree.fromstring(data)
+    return root.findall('{http://www.w3.org/2000/svg}style')
+
+
+class RenderTest(unittest.TestCase):
+
+    def test_top_level_style(self):
+        svg = read_sample().replace(
+            '<g id="kvg:StrokePaths_',
+            '<style>path { stroke-opacity: 0.5; }</style>\n'
+            '<g id="kvg:StrokePaths_', 1)
+        for output_type in OUTPUTS:
+            data = kanimaji.render(svg, [output_type])[output_type]
+            styles = top_styles(data)
+            # the document's own style is kept, along with the animation's
+            ids = [style.get('id') for style in styles]
+            self.assertEqual(sorted(ids), [None, 'style-Kanimaji'])
+            self.assertIn('stroke-opacity', styles[ids.index(None)].text)
+
+    def test_render_again(self):
+        # the animation of a previous run is replaced, not added to
+        svg = read_sample()
+        for output_type in OUTPUTS:
+            data = kanimaji.render(svg, [output_type])[output_type]
+            again = kanimaji.render(data, [output_type], name='04e8c')
+            self.assertEqual(again[output_type], data)
+
+    def test_alternating_settings(self):
+        # nothing of a rendering is left over for the next one
+        other = os.path.join(os.path.dirname(SAMPLE), '06c34.svg')
+        with open(other, 'rb') as f:
+            documents = [read_sample(), f.read()]
+        settings = [kanimaji.Settings(),
+                    kanimaji.Settings(SHOW_BRUSH=False,
+                                      STOKE_FILLED_COLOR='#c00')]
+        for output_type in OUTPUTS:
+            alone = [kanimaji.render(svg, [output_type], s)[output_type]
+                     for svg, s in zip(documents, settings)]
+            self.assertNotIn('#c00', alone[0])
+            self.assertIn('#c00', alone[1])
+            for i in range(4):
+                j = i % 2
+                data = kanimaji.render(documents[j], [output_type],
+                                       settings[j])
+                self.assertEqual(data[output_type], alone[j])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""
+The cache of the render server, and the coalescing of the renderings of
+the same animation requested at once.
+
+    python -m unittest discover
+"""
+
+import threading
+import time
+import unittest
+
+import server
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = server.LRUCache(10)
+        cache.put('a', 'A', 4)
+        cache.put('b', 'B', 4)
+        self.assertEqual(cache.get('a'), 'A')  # b is now the oldest
+        cache.put('c', 'C', 4)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache.get('c'), 'C')
+        self.assertEqual((len(cache), cache.size), (2, 8))
+
+    def test_at_capacity(self):
+        cache = server.LRUCache(10)
+        cache.put('a', 'A', 5)
+        cache.put('b', 'B', 5)
+        self.assertEqual((len(cache), cache.size), (2, 10))
+        cache.put('c', 'C', 1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual((len(cache), cache.size), (2, 6))
+
+    def test_replace(self):
+        cache = server.LRUCache(10)
+        cache.put('a', 'A', 4)
+        cache.put('a', 'AA', 6)
+        self.assertEqual(cache.get('a'), 'AA')
+        self.assertEqual(cache.size, 6)
+
+    def test_too_big(self):
+        cache = server.LRUCache(10)
+        cache.put('a', 'A', 4)
+        cache.put('b', 'B', 11)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'A')
+
+
+class _Pool(object):
+    """Runs the renderings in the calling thread."""
+
+    def apply(self, function, args):
+        return function(*args)
+
+
+class RenderServiceTest(unittest.TestCase):
+
+    THREADS = 8
+
+    def setUp(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.saved = server._render_file
+        server._render_file = self.render_file
+        self.service = server.RenderService('.', _Pool(),
+                                            server.LRUCache(1024))
+
+    def tearDown(self):
+        server._render_file = self.saved
+
+    def render_file(self, args):
+        self.calls.append(args)
+        self.release.wait(10)
+        if args[0].endswith('bad.svg'):
+            raise RuntimeError('cannot render')
+        return 'data of %s' % args[0]
+
+    def get_concurrently(self, name):
+        results = []
+        errors = []
+
+        def get():
+            try:
+                results.append(self.service.get('svg', name))
+            except RuntimeError as e:
+                errors.append(e)
+        threads = [threading.Thread(target=get)
+                   for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        # all the others wait for the first one's rendering
+        deadline = time.time() + 10
+        while (self.service.coalesced < self.THREADS - 1 and
+               time.time() < deadline):
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join(10)
+        return results, errors
+
+    def test_coalesced(self):
+        results, errors = self.get_concurrently('06c34')
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), self.THREADS)
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual((self.service.renders, self.service.coalesced),
+                         (1, self.THREADS - 1))
+        # then cached
+        self.assertEqual(self.service.get('svg', '06c34'), results[0])
+        self.assertEqual(len(self.calls), 1)
+
+    def test_failure(self):
+        results, errors = self.get_concurrently('bad')
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual((len(results), len(errors)), (0, self.THREADS))
+        # failures aren't cached
+        self.assertRaises(RuntimeError, self.service.get, 'svg', 'bad')
+        self.assertEqual(len(self.calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
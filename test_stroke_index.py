@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+The stroke index: stroke groups saved and loaded back for the key they
+were measured with, and the animations generated from it.
+
+    python -m unittest discover
+"""
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import kanimaji
+import stroke_index
+from stroke_index import StrokeIndex
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'bench', 'kanji')
+
+GROUPS = {
+    '04e00': [('kvg:04e00', [('kvg:04e00-s1', 'M11,54.25c3.25,0.5 5,0 7,0',
+                              77.03125, 0.4375)])],
+    u'04e8c-Kaisho': [
+        ('kvg:04e8c', [('kvg:04e8c-s1', 'M30,30h40', 40.0, 0.25)]),
+        (u'kvg:04e8c-g1-二', [
+            ('kvg:04e8c-s2', 'M20,70h60', 60.0, 0.3125),
+            ('kvg:04e8c-s3', u'M20,80h60 …', 60.5, 0.3125)]),
+        ('kvg:04e8c-g2', []),
+    ],
+    '05341': [],
+}
+
+
+class StrokeIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'index.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, key='key'):
+        index = StrokeIndex(self.filename, key)
+        self.assertEqual(len(index), 0)
+        for name, groups in GROUPS.items():
+            index.put(name, 'hash of %s' % name, groups)
+        index.save()
+
+    def test_round_trip(self):
+        self.write()
+        index = StrokeIndex(self.filename, 'key')
+        self.assertEqual(sorted(index.names()), sorted(GROUPS))
+        for name, groups in GROUPS.items():
+            self.assertIn(name, index)
+            self.assertTrue(index.is_up_to_date(name, 'hash of %s' % name))
+            self.assertFalse(index.is_up_to_date(name, 'another hash'))
+            self.assertEqual(index.get(name), groups)
+        self.assertEqual(index.get('04e01'), None)
+
+        # saved again, with the rows still only in columns
+        index.remove('05341')
+        index.put('04e01', 'hash', GROUPS['04e00'])
+        index.save()
+        index = StrokeIndex(self.filename, 'key')
+        self.assertEqual(sorted(index.names()),
+                         ['04e00', '04e01', u'04e8c-Kaisho'])
+        self.assertEqual(index.get('04e8c-Kaisho'), GROUPS['04e8c-Kaisho'])
+        self.assertEqual(index.get('04e01'), GROUPS['04e00'])
+
+    def test_other_key(self):
+        self.write()
+        self.assertEqual(len(StrokeIndex(self.filename, 'other key')), 0)
+
+    def test_other_format(self):
+        self.write()
+        with numpy.load(self.filename) as data:
+            columns = dict(data.items())
+        columns['format'] = numpy.array(stroke_index.FORMAT + 1)
+        with open(self.filename, 'wb') as f:
+            numpy.savez(f, **columns)
+        self.assertEqual(len(StrokeIndex(self.filename, 'key')), 0)
+
+    def test_unreadable(self):
+        for data in ['not an index', 'PK\3\4 truncated']:
+            with open(self.filename, 'wb') as f:
+                f.write(data)
+            index = StrokeIndex(self.filename, 'key')
+            self.assertEqual(len(index), 0)
+            # and written over
+            index.put('04e00', 'hash', GROUPS['04e00'])
+            index.save()
+            self.assertEqual(StrokeIndex(self.filename, 'key').get('04e00'),
+                             GROUPS['04e00'])
+
+
+class IndexedAnimationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = dict((name, getattr(kanimaji, name)) for name in
+                          ['OUTPUT_DIR', 'STROKE_INDEX_FILE',
+                           'LENGTH_CACHE_FILE', '_length_cache',
+                           '_stroke_index'])
+        kanimaji.OUTPUT_DIR = os.path.join(self.tmpdir, 'converted')
+        kanimaji.STROKE_INDEX_FILE = os.path.join(self.tmpdir, 'index.npz')
+        kanimaji.LENGTH_CACHE_FILE = None
+        kanimaji._length_cache = None
+        self.svg_paths = sorted(glob.glob(os.path.join(CORPUS_DIR,
+                                                       '*.svg')))[:4]
+        self.hashes = dict((kanimaji.basename(svg_path), 'hash')
+                           for svg_path in self.svg_paths)
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(kanimaji, name, value)
+        shutil.rmtree(self.tmpdir)
+
+    def outputs(self, svg_path):
+        kanimaji.create_animation(svg_path, generate_svg=True,
+                                  generate_js_svg=True)
+        data = []
+        for output_type in ['svg', 'js_svg']:
+            with open(kanimaji.output_path(svg_path, output_type)) as f:
+                data.append(f.read())
+        return data
+
+    def test_same_animations(self):
+        measured = [self.outputs(svg_path) for svg_path in self.svg_paths]
+        kanimaji.update_stroke_index(self.svg_paths, self.hashes)
+        key = kanimaji.stroke_index_key(kanimaji.default_settings())
+        index = StrokeIndex(kanimaji.STROKE_INDEX_FILE, key)
+        self.assertEqual(sorted(index.names()), sorted(self.hashes))
+        for svg_path, data in zip(self.svg_paths, measured):
+            self.assertEqual(self.outputs(svg_path), data)
+
+    def test_generated_from_index(self):
+        svg_path = os.path.join(CORPUS_DIR, '04e8c.svg')
+        kanimaji.update_stroke_index([svg_path], {'04e8c.svg': 'hash'})
+        index = kanimaji.get_stroke_index()
+        # the durations are the index's, not measured again
+        groups = [(group_id, [stroke[:3] + (2.0,) for stroke in strokes])
+                  for group_id, strokes in index.get('04e8c.svg')]
+        index.put('04e8c.svg', 'hash', groups)
+        svg, js_svg = self.outputs(svg_path)
+        self.assertEqual(js_svg.count('data-duration="2.0"'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+The packed stroke timeline file: records written by write_timelines() read
+back by TimelineFile, and files of another format refused.
+
+    python -m unittest discover
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import timeline
+
+# name: animation time, lengths, durations, polylines, all exact as
+# float32
+KANJI = {
+    '04e00': (1.5, [100.25], [0.75], [[(10.0, 50.0), (90.0, 50.0)]]),
+    '04e14': (2.0, [30.0, 40.0], [0.5, 0.5],
+              [[(0.0, 0.0), (1.0, 1.0)], [(2.0, 2.0), (3.0, 3.0),
+                                          (4.0, 4.5)]]),
+    '04e14-Kaisho': (2.5, [31.0, 41.0], [0.25, 1.25],
+                     [[(5.0, 5.0), (6.0, 6.0)], [(7.0, 7.0), (8.0, 8.0)]]),
+    '06c34': (3.0, [10.0, 20.0, 30.0, 40.0], [0.125, 0.25, 0.375, 0.5],
+              [[(0.0, 0.0)] * 2] * 4),
+    '2a6b2': (1.0, [], [], []),
+}
+
+
+class TimelineFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'timelines.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, polylines):
+        records = dict(
+            (name, timeline.pack_record(
+                time, lengths, durations, polys if polylines else None))
+            for name, (time, lengths, durations, polys) in KANJI.items())
+        timeline.write_timelines(self.filename, records,
+                                 'cubic-bezier(0.1, 0.7, 1, 0.1)', polylines)
+        return records
+
+    def open(self):
+        timelines = timeline.TimelineFile(self.filename)
+        self.addCleanup(timelines.close)
+        return timelines
+
+    def assertTimeline(self, found, name, polylines):
+        time, lengths, durations, polys = KANJI[name]
+        self.assertEqual(found.animation_time, time)
+        self.assertEqual(len(found), len(lengths))
+        self.assertEqual(list(found.lengths), lengths)
+        self.assertEqual(list(found.durations), durations)
+        if polylines:
+            self.assertEqual([[tuple(p) for p in points]
+                              for points in found.polylines], polys)
+        else:
+            self.assertEqual(found.polylines, None)
+
+    def test_round_trip(self):
+        for polylines in [False, True]:
+            records = self.write(polylines)
+            timelines = self.open()
+            self.assertEqual(len(timelines), len(KANJI))
+            self.assertEqual(timelines.has_polylines, polylines)
+            self.assertEqual(timelines.timing_function,
+                             'cubic-bezier(0.1, 0.7, 1, 0.1)')
+            self.assertEqual(list(timelines.names()), sorted(KANJI))
+            for name in KANJI:
+                code, variant = timeline.split_name(name)
+                self.assertTimeline(timelines.get(code, variant), name,
+                                    polylines)
+                self.assertEqual(str(timelines.record(code, variant)),
+                                 records[name])
+
+    def test_without_numpy(self):
+        self.write(True)
+        saved, timeline.numpy = timeline.numpy, None
+        try:
+            timelines = self.open()
+            for name in KANJI:
+                self.assertTimeline(timelines.get(*timeline.split_name(name)),
+                                    name, True)
+        finally:
+            timeline.numpy = saved
+
+    def test_lookup(self):
+        self.write(False)
+        timelines = self.open()
+        # by character as well as code point
+        self.assertTimeline(timelines.get(u'\u4e00'), '04e00', False)
+        self.assertTimeline(timelines.get(0x4e14, 'Kaisho'),
+                            '04e14-Kaisho', False)
+        for kanji, variant in [(0x4e01, ''), (0x4e14, 'Gyosho'),
+                               (0x0, ''), (0x2a6b3, ''), (0x6c34, 'Kaisho')]:
+            self.assertRaises(KeyError, timelines.get, kanji, variant)
+
+    def test_other_files(self):
+        self.write(False)
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        for header in ['KNTX' + data[4:6],
+                       'KNTL' + struct.pack('<H', timeline.FORMAT + 1)]:
+            with open(self.filename, 'wb') as f:
+                f.write(header + data[6:])
+            self.assertRaises(ValueError, timeline.TimelineFile,
+                              self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+CSS timing functions, at the ends of the animation of a stroke where the
+cubic solver used to pick the wrong root.
+
+    python -m unittest discover
+"""
+
+import unittest
+
+import gif_frames
+import timing
+
+# the value of each keyword at 0 and at 1
+ENDS = {
+    'linear': (0.0, 1.0),
+    'ease': (0.0, 1.0),
+    'ease-in': (0.0, 1.0),
+    'ease-out': (0.0, 1.0),
+    'ease-in-out': (0.0, 1.0),
+    'step-start': (1.0, 1.0),
+    'step-end': (0.0, 1.0),
+}
+
+CURVES = sorted(timing.KEYWORD_CURVES) + [
+    'cubic-bezier(0.1, 0.7, 1, 0.1)',
+    'cubic-bezier(0, 1.5, 1, -0.5)',
+]
+
+
+class EndsTest(unittest.TestCase):
+
+    def test_keywords_cover_all(self):
+        self.assertEqual(set(ENDS), set(['linear']) |
+                         set(timing.KEYWORD_CURVES) |
+                         set(timing.KEYWORD_STEPS))
+
+    def test_keywords(self):
+        for name, (start, end) in sorted(ENDS.items()):
+            function = timing._parse(name)
+            self.assertEqual(function(0.0), start, name)
+            self.assertEqual(function(1.0), end, name)
+            self.assertEqual(function.array([0.0, 1.0]).tolist(),
+                             [start, end], name)
+            self.assertEqual(function.array([0.0, 1.0], 1024).tolist(),
+                             [start, end], name)
+
+    def test_curves(self):
+        for name in CURVES:
+            function = timing._parse(name)
+            for x, y in [(0.0, 0.0), (1.0, 1.0), (-0.5, 0.0), (1.5, 1.0)]:
+                self.assertEqual(function(x), y, (name, x))
+                self.assertEqual(function.array([x]).tolist(), [y],
+                                 (name, x))
+
+    def test_first_frame(self):
+        # the first frame is at the start of the first stroke
+        for name in CURVES:
+            function = timing._parse(name)
+            timeline = gif_frames.StrokeTimeline(
+                [0.5, 0.3], [0.0, 0.25, 0.5, 0.8], function.array)
+            self.assertEqual(timeline.states[0].tolist(),
+                             [gif_frames.DRAWING, gif_frames.PENDING])
+            self.assertEqual(timeline.progressions[0, 0], 0.0, name)
+            self.assertEqual(timeline.progressions[2, 1], 0.0, name)
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_steps_css(self):
+        for spec, css in [('steps(4, end)', 'steps(4, end)'),
+                          ('steps(4,start)', 'steps(4, start)'),
+                          ('steps(4)', 'steps(4)'),
+                          ('steps(3, jump-both)', 'steps(3, jump-both)'),
+                          ('step-start', 'step-start'),
+                          ('step-end', 'step-end')]:
+            self.assertEqual(timing._parse(spec).css, css)
+
+    def test_steps_positions(self):
+        # the same steps, whichever way they are written
+        for a, b in [('steps(4, end)', 'steps(4, jump-end)'),
+                     ('steps(4)', 'steps(4, jump-end)'),
+                     ('steps(4, start)', 'steps(4, jump-start)'),
+                     ('step-start', 'steps(1, jump-start)'),
+                     ('step-end', 'steps(1, jump-end)')]:
+            x = [0.0, 0.1, 0.3, 0.5, 0.74, 0.76, 1.0]
+            self.assertEqual(timing._parse(a).array(x).tolist(),
+                             timing._parse(b).array(x).tolist(), a)
+
+    def test_not_finite(self):
+        for spec in ['cubic-bezier(0, inf, 1, 1)',
+                     'cubic-bezier(0, 0, 1, -infinity)',
+                     'cubic-bezier(nan, 0, 1, 1)']:
+            self.assertRaises(ValueError, timing._parse, spec)
+
+
+if __name__ == '__main__':
+    unittest.main()
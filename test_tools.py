@@ -0,0 +1,155 @@
+"""
+The ToolScheduler running the steps of many files: the number of steps of
+each stage at once, and the batches of batchable steps.
+
+    python -m unittest discover
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from tools import (
+    Step,
+    ToolError,
+    ToolScheduler,
+    batchable,
+    external,
+)
+
+
+class ToolSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.running = {}
+        self.most = {}
+
+    def record(self, stage, names):
+        with self.lock:
+            self.calls.append((stage, list(names)))
+            self.running[stage] = self.running.get(stage, 0) + 1
+            self.most[stage] = max(self.most.get(stage, 0),
+                                   self.running[stage])
+        # long enough for the other threads of the stage to start theirs
+        time.sleep(0.02)
+        with self.lock:
+            self.running[stage] -= 1
+
+    def calls_of(self, stage):
+        return [names for s, names in self.calls if s == stage]
+
+    def tool(self, stage):
+        @external
+        def run(names):
+            self.record(stage, names)
+            if 'bad' in names:
+                raise ToolError('%s failed on bad' % stage)
+        return run
+
+    def batch_tool(self, stage):
+        @external
+        @batchable
+        def run(names, option):
+            self.assertEqual(option, '--option')
+            self.record(stage, names)
+            if 'bad' in names:
+                raise ToolError('%s failed on bad' % stage)
+        return run
+
+    def test_limits(self):
+        scheduler = ToolScheduler({'export': 3, 'encode': 1})
+        export, encode = self.tool('export'), self.tool('encode')
+        names = ['k%d' % i for i in range(8)]
+        for name in names:
+            scheduler.submit(name, [Step('export', export, ([name],), []),
+                                    Step('encode', encode, ([name],), [])])
+        results = scheduler.join()
+        self.assertEqual(sorted(results), names)
+        for error, times in results.values():
+            self.assertEqual(error, None)
+            self.assertEqual(sorted(times), ['encode', 'export'])
+        self.assertEqual(self.most, {'export': 3, 'encode': 1})
+        for stage in ['export', 'encode']:
+            self.assertEqual(sorted(self.calls_of(stage)),
+                             [[name] for name in names])
+
+    def test_batches(self):
+        scheduler = ToolScheduler({'export': 2}, batch_sizes={'export': 3})
+        export, encode = self.batch_tool('export'), self.tool('encode')
+        names = ['k%d' % i for i in range(6)]
+        for name in names:
+            scheduler.submit(name, [
+                Step('export', export, ([name], '--option'), []),
+                Step('encode', encode, ([name],), [])])
+        results = scheduler.join()
+        self.assertEqual([error for error, times in results.values()],
+                         [None] * 6)
+        # merged in the order they were submitted
+        self.assertEqual(sorted(self.calls_of('export')),
+                         [names[:3], names[3:]])
+        self.assertEqual(len(self.calls_of('encode')), 6)
+        # the time of a batch is shared by its files
+        for batch in [names[:3], names[3:]]:
+            self.assertEqual(len(set(results[name][1]['export']
+                                     for name in batch)), 1)
+
+    def test_join_runs_partial_batches(self):
+        scheduler = ToolScheduler({}, batch_sizes={'export': 4})
+        export = self.batch_tool('export')
+        names = ['k%d' % i for i in range(6)]
+        for name in names:
+            scheduler.submit(name, [
+                Step('export', export, ([name], '--option'), [])])
+        # the first four at once, the last two wait for more
+        deadline = time.time() + 10
+        while len(scheduler.results) < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(scheduler.results), names[:4])
+        self.assertEqual(self.calls_of('export'), [names[:4]])
+        results = scheduler.join()
+        self.assertEqual(sorted(results), names)
+        self.assertEqual(self.calls_of('export'), [names[:4], names[4:]])
+
+    def test_failure_in_batch(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        scheduler = ToolScheduler({}, batch_sizes={'export': 3})
+        export, encode = self.batch_tool('export'), self.tool('encode')
+        names = ['k0', 'bad', 'k1']
+        files = {}
+        for name in names:
+            files[name] = os.path.join(tmpdir, name)
+            open(files[name], 'w').close()
+            scheduler.submit(name, [
+                Step('export', export, ([name], '--option'), [files[name]]),
+                Step('encode', encode, ([name],), [])])
+        results = scheduler.join()
+        # the batch failed, then each file was done alone
+        self.assertEqual(self.calls_of('export'),
+                         [names, ['k0'], ['bad'], ['k1']])
+        self.assertEqual(results['bad'][0],
+                         'ToolError: export failed on bad')
+        self.assertEqual((results['k0'][0], results['k1'][0]), (None, None))
+        self.assertEqual(sorted(self.calls_of('encode')), [['k0'], ['k1']])
+        # the files of a step are removed once it succeeded
+        self.assertEqual(os.listdir(tmpdir), ['bad'])
+
+    def test_failure_stops_the_file(self):
+        scheduler = ToolScheduler({'export': 2})
+        export, encode = self.tool('export'), self.tool('encode')
+        for name in ['k0', 'bad', 'k1']:
+            scheduler.submit(name, [Step('export', export, ([name],), []),
+                                    Step('encode', encode, ([name],), [])])
+        results = scheduler.join()
+        self.assertEqual(results['bad'][0],
+                         'ToolError: export failed on bad')
+        self.assertEqual(sorted(self.calls_of('encode')), [['k0'], ['k1']])
+
+
+if __name__ == '__main__':
+    unittest.main()
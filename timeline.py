@@ -0,0 +1,253 @@
+"""
+The stroke timelines of a whole corpus of kanji in a single packed binary
+file, for clients animating the strokes themselves (eg. a mobile app)
+without parsing SVGs: for each kanji the number of strokes, their lengths
+and durations as in the JS-SVG animations, and optionally the strokes
+flattened to polylines.
+
+All numbers are little-endian, and every array is 4 bytes aligned so it
+can be used in place:
+
+    header     magic 'KNTL', format (uint16), flags (uint16), number of
+               kanji, offset and size of the strings, offset of the
+               timing function in the strings (uint32 each)
+    index      for each kanji, sorted: code point, offset + 1 of its
+               variant name in the strings or 0, offset and size of its
+               record (uint32 each)
+    strings    the CSS timing function and the variant names, each
+               followed by a nul byte
+    records    number of strokes n (uint32), animation time in seconds
+               including the wait after the last stroke (float32), the
+               lengths (float32[n]) and durations in seconds (float32[n])
+               of the strokes, then with the POLYLINES flag, the number of
+               points of each stroke (uint32[n]) and their x, y
+               coordinates (float32[2 * points])
+
+TimelineFile looks kanji up by binary search in the index of the mapped
+file, so reading one doesn't load the rest of the corpus.
+"""
+
+import math
+import mmap
+import os
+import struct
+
+try:
+    import numpy
+except ImportError:  # records are decoded with struct
+    numpy = None
+
+MAGIC = 'KNTL'
+FORMAT = 1
+POLYLINES = 1
+
+HEADER = struct.Struct('<4sHHIIII')
+INDEX_ENTRY = struct.Struct('<IIII')
+RECORD_HEADER = struct.Struct('<If')
+
+
+def _pad(data):
+    return data + '\0' * (-len(data) % 4)
+
+
+def flatten(path, step):
+    """
+    The points of the svg.path path, curves being cut in pieces of about
+    step long at most.
+    """
+    points = []
+    for segment in path:
+        if not points:
+            points.append(segment.start)
+        if segment.start == segment.end and not hasattr(segment, 'control1'):
+            # moves and empty lines
+            continue
+        if hasattr(segment, 'control1'):
+            # the control polygon is at least as long as the curve
+            polygon = (abs(segment.control1 - segment.start) +
+                       abs(segment.control2 - segment.control1) +
+                       abs(segment.end - segment.control2))
+            n = max(1, int(math.ceil(polygon / step)))
+            points.extend(segment.point(float(i) / n)
+                          for i in range(1, n + 1))
+        else:
+            points.append(segment.end)
+    return [(p.real, p.imag) for p in points]
+
+
+def pack_record(animation_time, lengths, durations, polylines=None):
+    n = len(lengths)
+    data = [RECORD_HEADER.pack(n, animation_time),
+            struct.pack('<%df' % n, *lengths),
+            struct.pack('<%df' % n, *durations)]
+    if polylines is not None:
+        data.append(struct.pack('<%dI' % n, *map(len, polylines)))
+        coordinates = [c for points in polylines for p in points for c in p]
+        data.append(struct.pack('<%df' % len(coordinates), *coordinates))
+    return ''.join(data)
+
+
+def split_name(name):
+    """The code point and variant ('' if none) of a KanjiVG file name."""
+    code, _, variant = name.partition('-')
+    return int(code, 16), variant
+
+
+def write_timelines(filename, records, timing, polylines=False):
+    """
+    Writes the records, a dict of the packed record of each KanjiVG name
+    (eg. '04e14-Kaisho'), to filename.
+    """
+    keys = sorted((split_name(name), name) for name in records)
+    strings = [timing + '\0']
+    strings_size = len(strings[0])
+    index = []
+    offset = HEADER.size + INDEX_ENTRY.size * len(keys)
+    for (code, variant), name in keys:
+        if variant:
+            variant_offset = strings_size + 1
+            strings.append(variant + '\0')
+            strings_size += len(variant) + 1
+        else:
+            variant_offset = 0
+        index.append((code, variant_offset, name))
+    strings = _pad(''.join(strings))
+    offset += len(strings)
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT, POLYLINES if polylines else 0,
+                            len(keys), HEADER.size +
+                            INDEX_ENTRY.size * len(keys), strings_size, 0))
+        for code, variant_offset, name in index:
+            f.write(INDEX_ENTRY.pack(code, variant_offset, offset,
+                                     len(records[name])))
+            offset += len(_pad(records[name]))
+        f.write(strings)
+        for code, variant_offset, name in index:
+            f.write(_pad(records[name]))
+    os.rename(tmp, filename)
+
+
+class StrokeTimeline(object):
+    """
+    The timeline of a kanji: its animation time, and the lengths,
+    durations and polylines (None if not in the file) of its strokes.
+    Arrays are NumPy views of the mapped file when NumPy is available.
+    """
+
+    def __init__(self, data, offset, polylines):
+        n, self.animation_time = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        self.lengths = _floats(data, offset, n)
+        self.durations = _floats(data, offset + 4 * n, n)
+        self.polylines = None
+        if polylines:
+            offset += 8 * n
+            counts = struct.unpack_from('<%dI' % n, data, offset)
+            offset += 4 * n
+            self.polylines = []
+            for count in counts:
+                points = _floats(data, offset, 2 * count)
+                if numpy is not None:
+                    points = points.reshape(count, 2)
+                else:
+                    points = zip(points[0::2], points[1::2])
+                self.polylines.append(points)
+                offset += 8 * count
+
+    def __len__(self):
+        return len(self.lengths)
+
+
+def _floats(data, offset, count):
+    if numpy is not None:
+        return numpy.frombuffer(data, '<f4', count, offset)
+    return struct.unpack_from('<%df' % count, data, offset)
+
+
+class TimelineFile(object):
+    """A file written by write_timelines(), mapped in memory."""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.flags, self.count, self._strings,
+         strings_size, timing) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != FORMAT:
+            self.close()
+            raise ValueError('%s is not a stroke timeline file' % filename)
+        self.timing_function = self._string(timing)
+        self.has_polylines = bool(self.flags & POLYLINES)
+
+    def close(self):
+        self._map.close()
+
+    def _string(self, offset):
+        start = self._strings + offset
+        return self._map[start:self._map.find('\0', start)]
+
+    def _entry(self, i):
+        return INDEX_ENTRY.unpack_from(self._map,
+                                       HEADER.size + i * INDEX_ENTRY.size)
+
+    def _find(self, kanji, variant=''):
+        if isinstance(kanji, basestring):
+            kanji = ord(kanji)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._entry(mid)[0] < kanji:
+                lo = mid + 1
+            else:
+                hi = mid
+        # the variants of a kanji follow each other, the plain one first
+        for i in xrange(lo, self.count):
+            code, variant_offset, offset, size = self._entry(i)
+            if code != kanji:
+                break
+            if (self._string(variant_offset - 1) if variant_offset
+                    else '') == variant:
+                return offset, size
+        raise KeyError(kanji if not variant else (kanji, variant))
+
+    def record(self, kanji, variant=''):
+        """
+        The packed record of kanji (a character or code point), without
+        copying it, eg. to send it as is to a client.
+        """
+        offset, size = self._find(kanji, variant)
+        return buffer(self._map, offset, size)
+
+    def get(self, kanji, variant=''):
+        """The StrokeTimeline of kanji, raising KeyError if it isn't there."""
+        offset, size = self._find(kanji, variant)
+        return StrokeTimeline(self._map, offset, self.has_polylines)
+
+    def names(self):
+        """The KanjiVG names of all the kanji in the file, in order."""
+        for i in xrange(self.count):
+            code, variant_offset, offset, size = self._entry(i)
+            variant = (self._string(variant_offset - 1) if variant_offset
+                       else '')
+            yield '%05x%s' % (code, '-' + variant if variant else '')
+
+    def __len__(self):
+        return self.count
+
+
+if __name__ == '__main__':
+    import sys
+    timelines = TimelineFile(sys.argv[1])
+    print '%d kanji, timing function %s' % (len(timelines),
+                                            timelines.timing_function)
+    for name in sys.argv[2:]:
+        code, variant = split_name(name)
+        timeline = timelines.get(code, variant)
+        print '%s: %d strokes in %.3fs' % (name, len(timeline),
+                                          timeline.animation_time)
+        for i in range(len(timeline)):
+            print '  %2d  length %7.3f  duration %.3fs%s' % (
+                i + 1, timeline.lengths[i], timeline.durations[i],
+                '  %d points' % len(timeline.polylines[i])
+                if timeline.polylines is not None else '')
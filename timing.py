@@ -0,0 +1,207 @@
+"""
+CSS timing functions, evaluated the way browsers do so that the rasterized
+GIF frames match the animated SVG.
+
+parse() accepts the keywords (linear, ease, ease-in, ease-out, ease-in-out,
+step-start, step-end) and the cubic-bezier(x1, y1, x2, y2) and
+steps(n[, position]) functions, see
+  https://developer.mozilla.org/en-US/docs/Web/CSS/easing-function
+Each distinct curve is parsed once, and the table it is interpolated from
+is only sampled once.
+"""
+
+import math
+import re
+
+import bezier_cubic
+
+# evaluating arrays needs NumPy, only imported then
+
+# ease, ease-in, etc:
+# https://developer.mozilla.org/en-US/docs/Web/CSS/timing-function#ease
+KEYWORD_CURVES = {
+    'ease': (0.25, 0.1, 0.25, 1.0),
+    'ease-in': (0.42, 0.0, 1.0, 1.0),
+    'ease-in-out': (0.42, 0.0, 0.58, 1.0),
+    'ease-out': (0.0, 0.0, 0.58, 1.0),
+}
+KEYWORD_STEPS = {
+    'step-start': (1, 'jump-start'),
+    'step-end': (1, 'jump-end'),
+}
+STEP_POSITIONS = {
+    'start': 'jump-start',
+    'end': 'jump-end',
+    'jump-start': 'jump-start',
+    'jump-end': 'jump-end',
+    'jump-none': 'jump-none',
+    'jump-both': 'jump-both',
+}
+
+_FUNCTION_RE = re.compile(r'^([a-z-]+)\((.*)\)$')
+
+
+class TimingFunction(object):
+    """
+    Maps the fraction of the duration elapsed to the fraction of the
+    progression, called on a number or, with array(), on a NumPy array.
+    css is how it is written in the generated style sheets.
+    """
+
+    def __init__(self, css):
+        self.css = css
+        self._tables = {}
+
+    def array(self, x, samples=0):
+        """
+        The values at a whole array of x, exact or approximated by linear
+        interpolation in a table of samples+1 values if samples is not 0.
+        """
+        import numpy
+        x = numpy.asarray(x, dtype=float)
+        if not samples:
+            return self._exact_array(x)
+        table = self._tables.get(samples)
+        if table is None:
+            table = self._tables[samples] = self._table(samples)
+        return numpy.interp(x, *table)
+
+    def _exact_array(self, x):
+        import numpy
+        return numpy.array([self(v) for v in x.tolist()], dtype=float)
+
+    def _table(self, samples):
+        import numpy
+        x = numpy.linspace(0, 1, samples+1)
+        return x, self._exact_array(x)
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self.css)
+
+
+class Linear(TimingFunction):
+
+    def __call__(self, x):
+        return x
+
+    def array(self, x, samples=0):
+        import numpy
+        return numpy.asarray(x, dtype=float)
+
+
+class CubicBezier(TimingFunction):
+
+    def __init__(self, css, x1, y1, x2, y2):
+        TimingFunction.__init__(self, css)
+        self.curve = (bezier_cubic.pt(0, 0), bezier_cubic.pt(x1, y1),
+                      bezier_cubic.pt(x2, y2), bezier_cubic.pt(1, 1))
+
+    def __call__(self, x):
+        return bezier_cubic.value(*(self.curve + (x,)))
+
+    def _exact_array(self, x):
+        return bezier_cubic.value_array(*(self.curve + (x,)))
+
+    def _table(self, samples):
+        return bezier_cubic.value_table(*(self.curve + (samples,)))
+
+
+class Steps(TimingFunction):
+
+    def __init__(self, css, steps, position):
+        TimingFunction.__init__(self, css)
+        self.steps = steps
+        self.jump_start = position in ('jump-start', 'jump-both')
+        self.jumps = steps + {'jump-none': -1,
+                              'jump-both': 1}.get(position, 0)
+
+    def __call__(self, x):
+        step = math.floor(x * self.steps)
+        if self.jump_start:
+            step += 1
+        if 0 <= x <= 1 and step > self.jumps:
+            step = self.jumps
+        return step / self.jumps
+
+    def _exact_array(self, x):
+        import numpy
+        step = numpy.floor(x * self.steps)
+        if self.jump_start:
+            step += 1
+        step = numpy.where((x >= 0) & (x <= 1) & (step > self.jumps),
+                           self.jumps, step)
+        return step / self.jumps
+
+    def array(self, x, samples=0):
+        # already cheaper than interpolating, and exact
+        import numpy
+        return self._exact_array(numpy.asarray(x, dtype=float))
+
+
+def _numbers(args, spec):
+    try:
+        numbers = [float(a) for a in args]
+    except ValueError:
+        raise ValueError('invalid timing function "%s"' % spec)
+    # float() takes inf and nan, CSS doesn't
+    if any(math.isinf(v) or math.isnan(v) for v in numbers):
+        raise ValueError('invalid timing function "%s"' % spec)
+    return numbers
+
+
+def _parse(spec):
+    name = re.sub(r'\s+', ' ', spec.strip().lower())
+    if name == 'linear':
+        return Linear(name)
+    if name in KEYWORD_CURVES:
+        return CubicBezier(name, *KEYWORD_CURVES[name])
+    if name in KEYWORD_STEPS:
+        return Steps(name, *KEYWORD_STEPS[name])
+
+    m = _FUNCTION_RE.match(name)
+    if m is None:
+        raise ValueError('invalid timing function "%s"' % spec)
+    function = m.group(1)
+    args = [a.strip() for a in m.group(2).split(',')]
+
+    if function == 'cubic-bezier':
+        if len(args) != 4:
+            raise ValueError('cubic-bezier() takes 4 numbers, in "%s"' % spec)
+        x1, y1, x2, y2 = _numbers(args, spec)
+        if not (0 <= x1 <= 1 and 0 <= x2 <= 1):
+            raise ValueError('the x coordinates of cubic-bezier() must be '
+                             'between 0 and 1, in "%s"' % spec)
+        return CubicBezier('cubic-bezier(%s)' % ', '.join(
+            '%g' % v for v in (x1, y1, x2, y2)), x1, y1, x2, y2)
+
+    if function == 'steps':
+        if len(args) not in (1, 2):
+            raise ValueError('steps() takes a number of steps and an '
+                             'optional position, in "%s"' % spec)
+        if not re.match(r'^\d+$', args[0]):
+            raise ValueError('the number of steps must be a positive '
+                             'integer, in "%s"' % spec)
+        steps = int(args[0])
+        written = args[1] if len(args) == 2 else 'end'
+        if written not in STEP_POSITIONS:
+            raise ValueError('invalid steps() position "%s", choose one of '
+                             '%s' % (written, ', '.join(sorted(STEP_POSITIONS))))
+        position = STEP_POSITIONS[written]
+        if steps < (2 if position == 'jump-none' else 1):
+            raise ValueError('too few steps in "%s"' % spec)
+        # written as given, older browsers only know start and end
+        return Steps('steps(%s)' % ', '.join([str(steps)] + args[1:]),
+                     steps, position)
+
+    raise ValueError('invalid timing function "%s"' % spec)
+
+
+_parsed = {}
+
+
+def parse(spec):
+    """The TimingFunction for spec, raising ValueError if it is invalid."""
+    function = _parsed.get(spec)
+    if function is None:
+        function = _parsed[spec] = _parse(spec)
+    return function
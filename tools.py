@@ -0,0 +1,235 @@
+"""
+Running the external tools making the GIFs (svgexport, convert, gifsicle).
+
+The work left for a file is a list of steps, each in a stage (eg.
+'convert') and run after the previous one succeeded. run_steps() runs them
+right away, while a ToolScheduler runs the steps of many files at once,
+each stage with its own number of threads, so that eg. gifsicle optimizes
+a GIF while convert assembles the next one and svgexport rasterizes a
+third.
+
+Steps of a batchable function in a stage of limited batch size are merged
+into a single call for many files, eg. so that svgexport starts its
+browser once for hundreds of kanji.
+
+Tools are run from argument lists, never through a shell, and a failure
+only stops the files it is for.
+"""
+
+import os
+import subprocess
+import threading
+import timeit
+from Queue import Queue
+from collections import namedtuple
+
+# function(*args) does the step, then the files remove are deleted
+Step = namedtuple('Step', 'stage function args remove')
+
+
+class ToolError(RuntimeError):
+    pass
+
+
+def external(function):
+    """Marks function as running an external tool."""
+    function.external = True
+    return function
+
+
+def batchable(function):
+    """
+    Marks function as able to do the steps of many files in one call, the
+    first argument being the concatenation of their first arguments.
+    """
+    function.batchable = True
+    return function
+
+
+def is_external(step):
+    return getattr(step.function, 'external', False)
+
+
+def merge_steps(steps):
+    """A single step doing the steps of a batchable function."""
+    first = steps[0]
+    return Step(first.stage, first.function,
+                (sum((list(step.args[0]) for step in steps), []),) +
+                tuple(first.args[1:]),
+                sum((list(step.remove) for step in steps), []))
+
+
+@external
+def run_tool(args):
+    """Runs the command args, raising ToolError if it fails."""
+    try:
+        process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+    except OSError as e:
+        raise ToolError('cannot run %s: %s' % (args[0], e))
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        raise ToolError('%s exited with status %d: %s' % (
+            args[0], process.returncode, output.strip()[-500:]))
+
+
+def tool_step(stage, args, remove=()):
+    return Step(stage, run_tool, (args,), list(remove))
+
+
+def _run_step(step, times, call=None):
+    start = timeit.default_timer()
+    try:
+        if call is None:
+            step.function(*step.args)
+        else:
+            call(step.function, step.args)
+    finally:
+        if times is not None:
+            times[step.stage] = (times.get(step.stage, 0) +
+                                 timeit.default_timer() - start)
+    for filename in step.remove:
+        os.remove(filename)
+
+
+def run_steps(steps, times=None):
+    """
+    Runs the steps one after the other, adding the time spent in each
+    stage to times if any.
+    """
+    for step in steps:
+        _run_step(step, times)
+
+
+class _Job(object):
+
+    def __init__(self, key, steps):
+        self.key = key
+        self.steps = list(steps)
+        self.times = {}
+
+
+class ToolScheduler(object):
+    """
+    Runs the steps of the submitted files concurrently, at most limits[stage]
+    at once for each stage (1 for stages not in limits). The steps that
+    aren't external tools are run with call(function, args) if given, eg.
+    a process pool's apply, rather than in the scheduler threads.
+
+    In the stages of batch_sizes, batchable steps wait for those of other
+    files, to be run batch_sizes[stage] at once (or what there is left
+    once all files are submitted). If a batch fails, its steps are run
+    again one at a time, so that only the files failing alone fail.
+
+    join() waits for all the files, returning for each key submitted its
+    error (None if it succeeded) and the seconds spent in each stage.
+    """
+
+    def __init__(self, limits, call=None, batch_sizes=None):
+        self.limits = limits
+        self.call = call
+        self.batch_sizes = batch_sizes or {}
+        self.results = {}
+        self._batches = {}
+        self._joining = False
+        self._queues = {}
+        self._threads = []
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+
+    def _queue(self, stage):
+        with self._lock:
+            queue = self._queues.get(stage)
+            if queue is None:
+                # the threads of a stage are only started when needed
+                queue = self._queues[stage] = Queue()
+                for i in range(max(1, self.limits.get(stage, 1))):
+                    thread = threading.Thread(target=self._work,
+                                              args=(queue,))
+                    thread.daemon = True
+                    thread.start()
+                    self._threads.append((queue, thread))
+            return queue
+
+    def submit(self, key, steps):
+        with self._lock:
+            self._pending += 1
+        self._advance(_Job(key, steps))
+
+    def _advance(self, job):
+        if not job.steps:
+            self._finish(job, None)
+            return
+        step = job.steps[0]
+        if (self.batch_sizes.get(step.stage, 1) > 1 and
+                getattr(step.function, 'batchable', False)):
+            with self._lock:
+                batch = self._batches.setdefault(step.stage, [])
+                batch.append(job)
+                if (len(batch) < self.batch_sizes[step.stage] and
+                        not self._joining):
+                    return
+                del self._batches[step.stage]
+            self._queue(step.stage).put(batch)
+        else:
+            self._queue(step.stage).put([job])
+
+    def _work(self, queue):
+        while True:
+            jobs = queue.get()
+            if jobs is None:
+                return
+            steps = [job.steps.pop(0) for job in jobs]
+            if len(steps) > 1:
+                error = self._run(merge_steps(steps), jobs)
+                if error is None:
+                    for job in jobs:
+                        self._advance(job)
+                    continue
+            # alone, or one by one once their batch failed
+            for job, step in zip(jobs, steps):
+                error = self._run(step, [job])
+                if error is None:
+                    self._advance(job)
+                else:
+                    self._finish(job, error)
+
+    def _run(self, step, jobs):
+        """Runs step for the jobs, returning its error or None."""
+        times = {}
+        try:
+            _run_step(step, times, None if is_external(step) else self.call)
+            error = None
+        except Exception as e:
+            error = '%s: %s' % (type(e).__name__, e)
+        for job in jobs:
+            # a batch's time is shared by its files
+            job.times[step.stage] = (job.times.get(step.stage, 0) +
+                                     times[step.stage] / len(jobs))
+        return error
+
+    def _finish(self, job, error):
+        with self._lock:
+            self.results[job.key] = (error, job.times)
+            self._pending -= 1
+            self._done.notify_all()
+
+    def join(self):
+        # no more files are coming to complete the batches
+        with self._lock:
+            batches, self._batches = self._batches.values(), {}
+            self._joining = True
+        for batch in batches:
+            self._queue(batch[0].steps[0].stage).put(batch)
+        with self._lock:
+            while self._pending:
+                # with a timeout, so that ^C isn't blocked
+                self._done.wait(1)
+            threads, self._threads = self._threads, []
+            self._queues = {}
+        for queue, thread in threads:
+            queue.put(None)
+        for queue, thread in threads:
+            thread.join()
+        return self.results